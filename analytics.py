@@ -0,0 +1,174 @@
+import config
+
+
+class _ScoreTree:
+    """Дерево Фенвика над значениями очков: число пользователей с каждым счетом
+
+    Обновление и подсчет «сколько пользователей набрали не больше s» – O(log n),
+    где n – максимальный счет. При росте счета дерево удваивается.
+    """
+
+    def __init__(self, size: int = 1024):
+        self._tree = [0] * (size + 1)
+
+    def add(self, score: int, delta: int):
+        if score + 1 >= len(self._tree):
+            self._grow(score + 1)
+        index = score + 1
+        while index < len(self._tree):
+            self._tree[index] += delta
+            index += index & -index
+
+    def count_up_to(self, score: int) -> int:
+        """Число пользователей со счетом <= score"""
+        index = min(score + 1, len(self._tree) - 1)
+        total = 0
+        while index > 0:
+            total += self._tree[index]
+            index -= index & -index
+        return total
+
+    def _grow(self, needed: int):
+        size = len(self._tree) - 1
+        while size < needed:
+            size *= 2
+        counts = [self.count_up_to(score) - self.count_up_to(score - 1) for score in range(len(self._tree) - 1)]
+        self._tree = [0] * (size + 1)
+        for score, count in enumerate(counts):
+            if count:
+                self.add(score, count)
+
+
+class _TopList:
+    """Первые `size` ключей по значению, поддерживаемые при каждом увеличении
+
+    Значения только растут на единицу, поэтому ключ вне списка может войти
+    в него, лишь обогнав последнего. Обновление – O(size), чтение – готовый список.
+    """
+
+    def __init__(self, values: dict, size: int):
+        self.values = values  # ключ -> текущее значение (общий словарь владельца)
+        self.size = size
+        self.keys = []
+
+    def bump(self, key):
+        """Значение key только что увеличилось"""
+        keys = self.keys
+        if key in keys:
+            position = keys.index(key)
+        elif len(keys) < self.size:
+            keys.append(key)
+            position = len(keys) - 1
+        elif self.values[key] > self.values[keys[-1]]:
+            keys[-1] = key
+            position = len(keys) - 1
+        else:
+            return
+
+        # При равенстве выше остается тот, кто набрал значение раньше
+        value = self.values[key]
+        while position > 0 and self.values[keys[position - 1]] < value:
+            keys[position] = keys[position - 1]
+            position -= 1
+        keys[position] = key
+
+    def items(self) -> list:
+        return [(key, self.values[key]) for key in self.keys]
+
+
+class ClassAnalytics:
+    """Рейтинг учеников и статистика ошибок, обновляемые на каждом выполнении
+
+    Счет ученика – число успешных выполнений кода. Место в рейтинге считается
+    по дереву Фенвика за O(log n); первые места и самые частые ошибки
+    хранятся готовыми, поэтому /top и /class_stats не перебирают пользователей.
+    """
+
+    def __init__(self, top_size: int = config.LEADERBOARD_SIZE,
+                 top_errors: int = config.CLASS_STATS_TOP_ERRORS):
+        self.scores = {}  # user_id -> счет
+        self.names = {}  # user_id -> отображаемое имя
+        self.error_counts = {}  # тип ошибки -> число
+        self.executions = 0
+        self.errors = 0
+        self._tree = _ScoreTree()
+        self._leaders = _TopList(self.scores, top_size)
+        self._top_errors = _TopList(self.error_counts, top_errors)
+
+    @property
+    def users(self) -> int:
+        """Число учеников, выполнявших код"""
+        return len(self.scores)
+
+    def set_name(self, user_id: int, name: str):
+        self.names[user_id] = name
+
+    def _ensure_user(self, user_id: int):
+        if user_id not in self.scores:
+            self.scores[user_id] = 0
+            self._tree.add(0, 1)
+
+    def record_execution(self, user_id: int, error_type: str = None):
+        """Учет выполнения: успех повышает счет, ошибка – счетчик своего типа"""
+        self._ensure_user(user_id)
+        self.executions += 1
+        if error_type is None:
+            score = self.scores[user_id]
+            self._tree.add(score, -1)
+            self._tree.add(score + 1, 1)
+            self.scores[user_id] = score + 1
+            self._leaders.bump(user_id)
+        else:
+            self.errors += 1
+            self.error_counts[error_type] = self.error_counts.get(error_type, 0) + 1
+            self._top_errors.bump(error_type)
+
+    def dump(self) -> dict:
+        """Данные для сохранения между перезапусками"""
+        return {
+            "scores": self.scores,
+            "names": self.names,
+            "error_counts": self.error_counts,
+            "executions": self.executions,
+            "errors": self.errors,
+        }
+
+    def load(self, data: dict):
+        """Восстановление из dump() в пустой объект; ключи user_id могут прийти строками (JSON)"""
+        for user_id, score in data.get("scores", {}).items():
+            user_id = int(user_id)
+            self._ensure_user(user_id)
+            self._tree.add(0, -1)
+            self._tree.add(score, 1)
+            self.scores[user_id] = score
+            self._leaders.bump(user_id)
+        self.names.update({int(user_id): name for user_id, name in data.get("names", {}).items()})
+        for error_type, count in data.get("error_counts", {}).items():
+            self.error_counts[error_type] = count
+            self._top_errors.bump(error_type)
+        self.executions += data.get("executions", 0)
+        self.errors += data.get("errors", 0)
+
+    def rank(self, user_id: int):
+        """Место ученика (1 – лучший) или None; равные счета делят место"""
+        score = self.scores.get(user_id)
+        if score is None:
+            return None
+        return self.users - self._tree.count_up_to(score) + 1
+
+    def leaders(self) -> list:
+        """[(user_id, имя, счет)] первых мест"""
+        return [
+            (user_id, self.names.get(user_id, f"Ученик {user_id}"), score)
+            for user_id, score in self._leaders.items()
+        ]
+
+    def summary(self) -> dict:
+        """Сводка по классу для /class_stats"""
+        return {
+            "users": self.users,
+            "executions": self.executions,
+            "errors": self.errors,
+            "error_rate": self.errors / self.executions if self.executions else 0.0,
+            "top_errors": self._top_errors.items(),
+        }
@@ -1,24 +1,26 @@
 from bot import PythonLearningBot
+from log_pipeline import setup_logging
+from tenancy import BotHost, load_tenants
 import logging
 import os
 
-# Настройка логирования для Render
-logging.basicConfig(
-    level=logging.INFO,
-    format='%(asctime)s - %(name)s - %(levelname)s - %(message)s'
-)
-
 def main():
-    """Запуск бота"""
-    bot = PythonLearningBot()
+    """Запуск бота (или нескольких ботов из TENANTS_FILE в одном процессе)"""
+    # Логирование через очередь и фоновый поток (не блокирует цикл событий).
+    # Только здесь: процессы-исполнители (spawn) заново импортируют app.py
+    # и не должны запускать свой поток логирования и открывать журнал событий
+    setup_logging()
+    tenants = load_tenants()
+    host = BotHost()
+    bots = [PythonLearningBot(tenant, host) for tenant in tenants]
     
     # Проверяем наличие токена
-    if not bot.application.bot.token:
+    if not all(bot.application.bot.token for bot in bots):
         logging.error("BOT_TOKEN не установлен!")
         return
     
-    logging.info("Бот запускается...")
-    bot.run()
+    logging.info("Бот запускается... (ботов в процессе: %s)", len(bots))
+    host.run()
 
 if __name__ == "__main__":
     main()
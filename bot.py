@@ -1,30 +1,79 @@
+import asyncio
+import json
 import logging
 import os
+import time
+from collections import OrderedDict
 from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
-from telegram.ext import Application, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, filters
-from python_console import PythonConsole
+from telegram.error import TelegramError
+from telegram.ext import Application, ApplicationHandlerStop, CommandHandler, MessageHandler, CallbackQueryHandler, ContextTypes, TypeHandler, filters
+import config
+import rendering
+from analytics import ClassAnalytics
+from broadcast import Broadcaster, UserRegistry
+from catalog import Catalog
+from cost_check import HEAVY, OK, CostChecker
+from limits import limits
+from log_pipeline import log_execution, outcome_of
+from metrics import metrics
+from scheduler import ScheduledUpdateProcessor
 from security import SecurityManager
-
-logging.basicConfig(level=logging.INFO)
+from tenancy import BotHost, TenantConfig
+from update_dedup import UpdateDeduplicator
 
 class PythonLearningBot:
-    def __init__(self):
-        self.token = os.getenv('BOT_TOKEN')
-        self.webhook_url = os.getenv('WEBHOOK_URL', '')
-        self.port = int(os.getenv('PORT', 10000))
+    def __init__(self, tenant: TenantConfig = None, host: BotHost = None):
+        # Без host бот работает в отдельном процессе, как раньше
+        self.tenant = tenant or TenantConfig.from_env()
+        self.token = self.tenant.token
         
         if not self.token:
             raise ValueError("BOT_TOKEN не установлен!")
             
-        self.application = Application.builder().token(self.token).build()
-        self.consoles = {}
+        self.host = host or BotHost()
+        self.analytics = ClassAnalytics()
+        self.catalog = Catalog.load(self.tenant.catalog)
+        # Пул песочниц и планировщик общие для всех ботов процесса
+        self.executor = self.host.add(self)
+        self.scheduler = self.host.scheduler
+        self.update_processor = ScheduledUpdateProcessor(
+            self.scheduler, short_commands=["trace", "cell", "edit"], long_commands=["run"],
+            tenant=self.tenant.name
+        )
+        self.application = (
+            Application.builder()
+            .token(self.token)
+            .concurrent_updates(self.update_processor)
+            .build()
+        )
+        self.active_runs = set()  # Пользователи с идущим выполнением /run
+        self.traces = OrderedDict()  # user_id -> последняя трассировка /trace
+        self.deduplicator = UpdateDeduplicator(
+            capacity=config.DEDUP_CAPACITY,
+            state_file=self.tenant.state_path(config.DEDUP_STATE_FILE),
+            max_age=config.DEDUP_MAX_AGE,
+            max_gap=config.DEDUP_MAX_GAP
+        )
+        self.registry = UserRegistry(self.tenant.state_path(config.USER_REGISTRY_FILE))
+        # Рассылка уступает живым запросам: пока код ждет песочницы, она стоит
+        self.broadcaster = Broadcaster(
+            self.application.bot, self.registry,
+            state_file=self.tenant.state_path(config.BROADCAST_STATE_FILE),
+            rate=config.BROADCAST_RATE,
+            is_busy=lambda: self.scheduler.queued > 0
+        )
         self.security = SecurityManager()
+        self.cost_checker = CostChecker()
         self.user_stats = {}  # Статистика пользователей
+        self.stats_file = self.tenant.state_path(config.STATS_FILE)
+        self.load_stats()
         
         self.setup_handlers()
         
     def setup_handlers(self):
         """Настройка обработчиков"""
+        # Отбрасываем повторные доставки до любых других обработчиков
+        self.application.add_handler(TypeHandler(Update, self.drop_duplicate_updates), group=-1)
         self.application.add_handler(CommandHandler("start", self.start))
         self.application.add_handler(CommandHandler("console", self.open_console))
         self.application.add_handler(CommandHandler("lessons", self.show_lessons))
@@ -33,10 +82,97 @@ class PythonLearningBot:
         self.application.add_handler(CommandHandler("stats", self.show_stats))
         self.application.add_handler(CommandHandler("help", self.show_help))
         self.application.add_handler(CommandHandler("quiz", self.show_quiz))
+        self.application.add_handler(CommandHandler("run", self.run_long))
+        self.application.add_handler(CommandHandler("trace", self.trace_code))
+        self.application.add_handler(CommandHandler("cell", self.add_cell))
+        self.application.add_handler(CommandHandler("edit", self.edit_cell))
+        self.application.add_handler(CommandHandler("cells", self.show_cells))
+        self.application.add_handler(CommandHandler("metrics", self.show_metrics))
+        self.application.add_handler(CommandHandler("top", self.show_top))
+        self.application.add_handler(CommandHandler("class_stats", self.show_class_stats))
+        self.application.add_handler(CommandHandler("broadcast", self.broadcast))
+        self.application.add_handler(CommandHandler("limits", self.manage_limits))
         self.application.add_handler(CallbackQueryHandler(self.button_handler))
         self.application.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, self.handle_message))
         self.application.add_error_handler(self.error_handler)
 
+    async def drop_duplicate_updates(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Остановка обработки повторно доставленного обновления"""
+        if self.deduplicator.is_duplicate(update.update_id):
+            logging.info("Повторное обновление %s отброшено", update.update_id)
+            raise ApplicationHandlerStop
+        if update.effective_user is not None:
+            self.registry.register(update.effective_user.id)
+
+    async def start_serving(self, webhook_url: str = ''):
+        """Запуск приложения: webhook (обновления принимает BotHost) или опрос"""
+        await self.application.initialize()
+        if webhook_url:
+            await self.application.bot.set_webhook(url=f"{webhook_url}/{self.token}")
+        else:
+            await self.application.updater.start_polling()
+        await self.application.start()
+        await self.on_startup()
+
+    async def on_startup(self):
+        """Продолжение прерванной рассылки"""
+        self.broadcaster.resume()
+
+    async def stop_accepting(self):
+        """Прекращение приема новых обновлений (опрос останавливается)"""
+        if self.application.updater is not None and self.application.updater.running:
+            await self.application.updater.stop()
+
+    def is_idle(self) -> bool:
+        """Нет обрабатываемых и ожидающих обновлений"""
+        return not self.update_processor.in_flight and self.application.update_queue.empty()
+
+    async def interrupt_long_work(self):
+        """Остановка длительных /run и рассылки (при плавной остановке)"""
+        for user_id in list(self.active_runs):
+            self.executor.cancel(user_id)
+        await self.broadcaster.stop()
+
+    async def stop_serving(self):
+        """Остановка приложения и сохранение состояния бота"""
+        await self.stop_accepting()
+        if self.application.running:
+            await self.application.stop()
+        await self.application.shutdown()
+        await self.on_shutdown()
+
+    async def on_shutdown(self):
+        """Сохранение состояния при остановке"""
+        await self.broadcaster.stop()
+        self.save_stats()
+        self.deduplicator.flush()
+
+    def load_stats(self):
+        """Статистика пользователей и класса, сохраненная при прошлой остановке"""
+        try:
+            with open(self.stats_file, encoding='utf-8') as f:
+                data = json.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, ValueError) as e:
+            logging.warning("Не удалось загрузить статистику: %s", e)
+            return
+        self.user_stats.update({int(user_id): stats for user_id, stats in data.get("user_stats", {}).items()})
+        self.analytics.load(data.get("analytics", {}))
+
+    def save_stats(self):
+        """Запись статистики на диск (атомарная замена файла)"""
+        try:
+            directory = os.path.dirname(self.stats_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.stats_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"user_stats": self.user_stats, "analytics": self.analytics.dump()}, f, ensure_ascii=False)
+            os.replace(tmp_path, self.stats_file)
+        except OSError as e:
+            logging.warning("Не удалось сохранить статистику: %s", e)
+
     async def start(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Обработчик команды /start"""
         user = update.effective_user
@@ -48,76 +184,18 @@ class PythonLearningBot:
                 "errors": 0,
                 "lessons_learned": 0
             }
+        self.analytics.set_name(user_id, user.first_name)
         
-        welcome_text = f"""
-🤖 *Привет, {user.first_name}!*
-
-Добро пожаловать в *Python Learning Bot* – интерактивный бот для обучения Python!
-
-📚 *Возможности:*
-💻 `/console` – Интерактивная Python консоль
-📖 `/lessons` – Уроки по Python
-🛡️ `/security` – Информация о безопасности
-📊 `/stats` – Ваша статистика
-❓ `/help` – Справка
-🎯 `/quiz` – Тест по Python
-
-🚀 *Начните вводить Python код, и я его выполню!*
-
-Пример:
-```
-print("Hello, Python!")
-x = 5 * 10
-x
-```
-        """
-        await update.message.reply_text(welcome_text, parse_mode='Markdown')
+        await update.message.reply_text(rendering.render_welcome(user.first_name), parse_mode='Markdown')
 
     async def show_help(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать справку"""
-        help_text = """
-📚 *Справка по Python Learning Bot*
-
-*Команды:*
-• `/start` – Главное меню
-• `/console` – Открыть консоль
-• `/lessons` – Уроки (5 уровней)
-• `/quiz` – Тест по Python
-• `/stats` – Ваша статистика
-• `/reset` – Сбросить консоль
-• `/security` – О безопасности
-
-*Возможности консоли:*
-✅ Выполнение Python кода
-✅ Сохранение переменных между запусками
-✅ Доступные модули: math, json, datetime, random
-✅ Ограничения: 1000 символов, 5 секунд на выполнение
-
-*Примеры:*
-```python
-# Переменные
-name = "Python"
-age = 30
-
-# Цикл
-for i in range(5):
-    print(i)
-
-# Функция
-def hello(x):
-    return x * 2
-
-# Математика
-import math
-math.sqrt(16)
-```
-        """
-        await update.message.reply_text(help_text, parse_mode='Markdown')
+        await update.message.reply_text(rendering.render_static("help"), parse_mode='Markdown')
 
     async def open_console(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Открыть интерактивную консоль"""
         user_id = update.effective_user.id
-        self.consoles[user_id] = PythonConsole()
+        await self.executor.reset(user_id)
         
         msg = """
 💻 *Интерактивная Python консоль открыта!*
@@ -151,11 +229,8 @@ math.sqrt(16)
     async def show_lessons(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать доступные уроки"""
         keyboard = [
-            [InlineKeyboardButton("1️⃣ Переменные и типы данных", callback_data="lesson_1")],
-            [InlineKeyboardButton("2️⃣ Условные операторы", callback_data="lesson_2")],
-            [InlineKeyboardButton("3️⃣ Циклы", callback_data="lesson_3")],
-            [InlineKeyboardButton("4️⃣ Функции", callback_data="lesson_4")],
-            [InlineKeyboardButton("5️⃣ Списки и словари", callback_data="lesson_5")],
+            [InlineKeyboardButton(title, callback_data=key)]
+            for key, title in self.catalog.lesson_titles.items()
         ]
         
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -168,11 +243,8 @@ math.sqrt(16)
     async def show_quiz(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать викторину"""
         keyboard = [
-            [InlineKeyboardButton("❓ Вопрос 1: Типы данных", callback_data="quiz_1")],
-            [InlineKeyboardButton("❓ Вопрос 2: Цикл for", callback_data="quiz_2")],
-            [InlineKeyboardButton("❓ Вопрос 3: Функции", callback_data="quiz_3")],
-            [InlineKeyboardButton("❓ Вопрос 4: Списки", callback_data="quiz_4")],
-            [InlineKeyboardButton("❓ Вопрос 5: Словари", callback_data="quiz_5")],
+            [InlineKeyboardButton(title, callback_data=key)]
+            for key, title in self.catalog.quiz_titles.items()
         ]
         
         reply_markup = InlineKeyboardMarkup(keyboard)
@@ -184,39 +256,7 @@ math.sqrt(16)
 
     async def security_info(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать информацию о безопасности"""
-        info = """
-🛡️ *Информация о безопасности бота*
-
-*Ограничения для защиты:*
-• Максимальная длина кода: 1000 символов
-• Время выполнения: 5 секунд
-• Память: 50 МБ
-
-*Запрещено:*
-❌ `import os`, `sys`, `subprocess`
-❌ `__import__()`, `eval()`, `exec()`
-❌ `open()`, `read()`, `write()` файлы
-❌ `socket`, `urllib`, `requests`
-❌ Доступ к приватным атрибутам (`__*__`)
-
-*Разрешено:*
-✅ `math` – математика
-✅ `json` – JSON данные
-✅ `datetime` – время
-✅ `random` – случайные числа
-✅ Встроенные функции (print, len, range и т.д.)
-✅ Работа с переменными, функциями, циклами
-✅ Списки, словари, кортежи, множества
-
-*Как работает безопасность:*
-1. Сканирование кода на опасные функции
-2. Проверка синтаксиса
-3. Контроль использования памяти
-4. Таймаут выполнения
-5. Фильтрация вывода ошибок
-
-        """
-        await update.message.reply_text(info, parse_mode='Markdown')
+        await update.message.reply_text(rendering.render_static("security"), parse_mode='Markdown')
 
     async def show_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Показать статистику пользователя"""
@@ -245,8 +285,8 @@ math.sqrt(16)
     async def reset_console(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
         """Сбросить консоль пользователя"""
         user_id = update.effective_user.id
-        if user_id in self.consoles:
-            result = self.consoles[user_id].reset_console()
+        if self.executor.has_session(user_id):
+            result = await self.executor.reset(user_id)
             await update.message.reply_text(result)
         else:
             await update.message.reply_text("Консоль еще не открыта. Используйте `/console`", parse_mode='Markdown')
@@ -259,6 +299,14 @@ math.sqrt(16)
         user_id = query.from_user.id
         callback_data = query.data
         
+        if callback_data == "stop_run":
+            self.executor.cancel(user_id)
+            return
+        
+        if callback_data.startswith("trace_"):
+            await self.show_trace_page(query, user_id, int(callback_data[len("trace_"):]))
+            return
+        
         # Обновление статистики
         if user_id not in self.user_stats:
             self.user_stats[user_id] = {
@@ -267,312 +315,362 @@ math.sqrt(16)
                 "lessons_learned": 0
             }
         
-        lessons_content = {
-            "lesson_1": """
-*📖 Урок 1: Переменные и типы данных*
-
-Переменная – это имя, которое хранит значение.
-
-```python
-# Строка (str)
-name = 'Python'
-greeting = "Hello, World!"
-
-# Целое число (int)
-age = 30
-count = 100
-
-# Число с плавающей точкой (float)
-height = 5.9
-price = 19.99
-
-# Булево значение (bool)
-is_active = True
-is_closed = False
-
-# Проверка типа
-print(type(name))      # <class 'str'>
-print(type(age))       # <class 'int'>
-print(type(height))    # <class 'float'>
-print(type(is_active)) # <class 'bool'>
-```
-
-*Задание:* Создайте переменные для вашего профиля!
-            """,
-            "lesson_2": """
-*📖 Урок 2: Условные операторы*
-
-Условные операторы позволяют выполнять различный код в зависимости от условия.
-
-```python
-age = 18
-
-# if-else
-if age >= 18:
-    print('Вы взрослый')
-else:
-    print('Вы несовершеннолетний')
-
-# if-elif-else
-if age < 13:
-    print('Вы ребенок')
-elif age < 18:
-    print('Вы подросток')
-else:
-    print('Вы взрослый')
-
-# Логические операторы
-if age > 18 and age < 65:
-    print('Работающий возраст')
-```
-
-*Задание:* Напишите условие для проверки четности числа!
-            """,
-            "lesson_3": """
-*📖 Урок 3: Циклы*
-
-Циклы повторяют код несколько раз.
-
-```python
-# Цикл for
-for i in range(5):
-    print(i)  # 0, 1, 2, 3, 4
-
-# Цикл while
-count = 0
-while count < 3:
-    print(count)
-    count += 1
-
-# Перебор списка
-fruits = ['яблоко', 'банан', 'апельсин']
-for fruit in fruits:
-    print(fruit)
-
-# range с параметрами
-for i in range(1, 10, 2):  # от 1 до 10, шаг 2
-    print(i)  # 1, 3, 5, 7, 9
-```
-
-*Задание:* Выведите таблицу умножения на 5!
-            """,
-            "lesson_4": """
-*📖 Урок 4: Функции*
-
-Функции – это блоки кода, которые можно переиспользовать.
-
-```python
-# Простая функция
-def greet():
-    return 'Привет!'
-
-print(greet())
+        if callback_data.startswith("lesson_"):
+            content = self.catalog.lessons.get(callback_data, "Урок не найден")
+            self.user_stats[user_id]["lessons_learned"] += 1
+        elif callback_data.startswith("quiz_"):
+            content = self.catalog.quiz.get(callback_data, "Вопрос не найден")
+        else:
+            content = "Опция не найдена"
+        
+        await query.edit_message_text(content, parse_mode='Markdown')
 
-# Функция с параметрами
-def add(a, b):
-    return a + b
+    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Обработка ввода кода"""
+        user_id = update.effective_user.id
+        code = update.message.text
+        self.analytics.set_name(user_id, update.effective_user.first_name)
 
-result = add(5, 3)
-print(result)  # 8
+        # Проверки безопасности и стоимости
+        if await self.reject_code(update, code, allow_heavy=False):
+            return
 
-# Функция с несколькими параметрами
-def calculate(x, y, operation):
-    if operation == '+':
-        return x + y
-    elif operation == '-':
-        return x - y
-    elif operation == '*':
-        return x * y
+        try:
+            started = time.monotonic()
+            result = await self.executor.execute(user_id, code)
+            log_execution("execute", user_id, outcome_of(result), time.monotonic() - started,
+                          code_size=len(code), output_size=len(result))
+            
+            if result.startswith(('❌', '⏰', '💥')):
+                messages = rendering.render_text(result)
+                if user_id in self.user_stats:
+                    self.user_stats[user_id]["errors"] += 1
+            else:
+                messages = rendering.render_execution(code, result)
+                if user_id in self.user_stats:
+                    self.user_stats[user_id]["codes_executed"] += 1
+            
+            for message in messages:
+                await update.message.reply_text(message, parse_mode='MarkdownV2')
+            
+        except Exception as e:
+            error_msg = rendering.render_text(f"❌ Системная ошибка:\n{str(e)}")[0]
+            await update.message.reply_text(error_msg, parse_mode='MarkdownV2')
+            if user_id in self.user_stats:
+                self.user_stats[user_id]["errors"] += 1
 
-print(calculate(10, 5, '*'))  # 50
-```
+    async def trace_code(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Пошаговая визуализация выполнения (/trace)"""
+        user_id = update.effective_user.id
+        parts = update.message.text.split(None, 1)
+        code = parts[1] if len(parts) > 1 else ""
+        if not code.strip():
+            await update.message.reply_text("Использование: `/trace <код>`", parse_mode='Markdown')
+            return
 
-*Задание:* Напишите функцию для вычисления площади прямоугольника!
-            """,
-            "lesson_5": """
-*📖 Урок 5: Списки и словари*
+        if await self.reject_code(update, code, allow_heavy=False):
+            return
 
-Списки и словари – это коллекции данных.
+        started = time.monotonic()
+        trace = await self.executor.trace(user_id, code)
+        log_execution("trace", user_id, outcome_of(trace["result"]), time.monotonic() - started,
+                      code_size=len(code), output_size=len(trace["output"]), steps=len(trace["steps"]))
+        if not trace["steps"]:
+            for message in rendering.render_text(trace["result"]):
+                await update.message.reply_text(message, parse_mode='MarkdownV2')
+            return
 
-```python
-# Список
-fruits = ['яблоко', 'банан', 'апельсин']
-numbers = [1, 2, 3, 4, 5]
-
-# Доступ к элементам
-print(fruits[0])    # яблоко
-print(fruits[-1])   # апельсин
-
-# Методы списков
-fruits.append('груша')
-fruits.remove('банан')
-print(len(fruits))  # 3
-
-# Словарь
-person = {
-    'имя': 'Иван',
-    'возраст': 25,
-    'город': 'Москва'
-}
-
-# Доступ к словарю
-print(person['имя'])      # Иван
-print(person.get('возраст'))  # 25
-
-# Добавление элемента
-person['профессия'] = 'Программист'
-```
+        # Страницы потом отдаются из сохраненной записи, без повторного выполнения
+        trace["code"] = code
+        self.traces[user_id] = trace
+        self.traces.move_to_end(user_id)
+        if len(self.traces) > config.TRACE_CACHE_USERS:
+            self.traces.popitem(last=False)
 
-*Задание:* Создайте словарь своего контакта!
-            """,
-        }
-        
-        quiz_questions = {
-            "quiz_1": """
-❓ *Вопрос 1: Какой это тип данных?*
+        await update.message.reply_text(
+            rendering.render_trace_page(code, trace, 0),
+            parse_mode='MarkdownV2',
+            reply_markup=self.trace_keyboard(0, len(trace["steps"]))
+        )
 
-```python
-x = 3.14
-```
+    @staticmethod
+    def trace_keyboard(index: int, total: int) -> InlineKeyboardMarkup:
+        """Кнопки листания трассировки"""
+        buttons = []
+        if index > 0:
+            buttons.append(InlineKeyboardButton("⏮", callback_data="trace_0"))
+            buttons.append(InlineKeyboardButton("◀️", callback_data=f"trace_{index - 1}"))
+        if index < total - 1:
+            buttons.append(InlineKeyboardButton("▶️", callback_data=f"trace_{index + 1}"))
+            buttons.append(InlineKeyboardButton("⏭", callback_data=f"trace_{total - 1}"))
+        return InlineKeyboardMarkup([buttons])
+
+    async def show_trace_page(self, query, user_id: int, index: int):
+        """Показ шага трассировки из сохраненной записи"""
+        trace = self.traces.get(user_id)
+        if trace is None or not 0 <= index < len(trace["steps"]):
+            await query.edit_message_text("Трассировка устарела. Запустите `/trace` еще раз", parse_mode='Markdown')
+            return
+        await query.edit_message_text(
+            rendering.render_trace_page(trace["code"], trace, index),
+            parse_mode='MarkdownV2',
+            reply_markup=self.trace_keyboard(index, len(trace["steps"]))
+        )
 
-A️⃣ int (целое число)
-B️⃣ float (число с плавающей точкой)
-C️⃣ str (строка)
-D️⃣ bool (булево значение)
+    async def reply_cells(self, update: Update, cells: list):
+        """Отправка ячеек блокнота"""
+        for message in rendering.render_cells(cells):
+            await update.message.reply_text(message, parse_mode='MarkdownV2')
 
-*Ответ:* B️⃣ float
-            """,
-            "quiz_2": """
-❓ *Вопрос 2: Сколько раз выполнится цикл?*
+    async def run_cells(self, update: Update, code: str, action: str, *args):
+        """Выполнение команды блокнота с записью события"""
+        user_id = update.effective_user.id
+        started = time.monotonic()
+        cells = await self.executor.notebook(user_id, action, *args)
+        outcomes = [outcome_of(result or "") for _, _, result in cells]
+        log_execution("notebook", user_id, next((o for o in outcomes if o != "ok"), "ok"),
+                      time.monotonic() - started, code_size=len(code),
+                      output_size=sum(len(result or "") for _, _, result in cells), cells_run=len(cells))
+        await self.reply_cells(update, cells)
+
+    async def add_cell(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Новая ячейка блокнота (/cell <код>)"""
+        parts = update.message.text.split(None, 1)
+        code = parts[1] if len(parts) > 1 else ""
+        if not code.strip():
+            await update.message.reply_text("Использование: `/cell <код>`", parse_mode='Markdown')
+            return
+        if await self.reject_code(update, code, allow_heavy=False):
+            return
+        await self.run_cells(update, code, "add", code)
 
-```python
-for i in range(3):
-    print(i)
-```
+    async def edit_cell(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Правка ячейки и перезапуск зависимых (/edit N <код>)"""
+        parts = update.message.text.split(None, 2)
+        if len(parts) < 3 or not parts[1].isdigit():
+            await update.message.reply_text("Использование: `/edit <номер> <код>`", parse_mode='Markdown')
+            return
+        number, code = int(parts[1]), parts[2]
+        if await self.reject_code(update, code, allow_heavy=False):
+            return
+        await self.run_cells(update, code, "edit", number, code)
 
-A️⃣ 2 раза
-B️⃣ 3 раза
-C️⃣ 4 раза
-D️⃣ Бесконечный цикл
+    async def show_cells(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Все ячейки блокнота (/cells)"""
+        await self.reply_cells(update, await self.executor.notebook(update.effective_user.id, "listing"))
 
-*Ответ:* B️⃣ 3 раза (0, 1, 2)
-            """,
-            "quiz_3": """
-❓ *Вопрос 3: Что вернет функция?*
+    def rejection_for(self, user_id: int, code: str, allow_heavy: bool):
+        """Проверки безопасности и стоимости до запуска песочницы; текст отказа (MarkdownV2) или None
 
-```python
-def test(x):
-    return x * 2
+        Общая для обычного ввода, /trace, /run и ячеек блокнота.
+        """
+        quick_check = self.security.sanitize_input(code)
+        if not quick_check["is_safe"]:
+            self.record_rejection(user_id, "SecurityViolation")
+            return rendering.render_rejection("❌ Обнаружены проблемы с безопасностью", quick_check["issues"][:3])
+
+        cost = self.cost_checker.check(code)
+        if cost["verdict"] == OK or (allow_heavy and cost["verdict"] == HEAVY):
+            return None
+
+        for reason in cost["reasons"]:
+            metrics.increment("static_rejected", label=reason)
+        # Оценка сэкономленной емкости пула: код занял бы песочницу на весь таймаут
+        metrics.increment("static_saved_worker_seconds", self.executor.max_execution_time)
+        self.record_rejection(user_id, "CostLimit")
+
+        hint = None
+        if cost["verdict"] == HEAVY and user_id in config.TRUSTED_USER_IDS:
+            hint = "Для долгих вычислений используйте /run"
+        return rendering.render_rejection("🚫 Код не будет выполнен", cost["issues"][:3], hint)
+
+    def record_rejection(self, user_id: int, error_type: str):
+        """Отклоненный без запуска код учитывается как ошибка ученика"""
+        self.analytics.record_execution(user_id, error_type)
+        if user_id in self.user_stats:
+            self.user_stats[user_id]["errors"] += 1
+
+    async def reject_code(self, update: Update, code: str, allow_heavy: bool) -> bool:
+        """Ответ с отказом, если код не проходит проверки; True – код отклонен"""
+        error_msg = self.rejection_for(update.effective_user.id, code, allow_heavy)
+        if error_msg is None:
+            return False
+        await update.message.reply_text(error_msg, parse_mode='MarkdownV2')
+        return True
+
+    async def show_metrics(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Служебные метрики (только для администраторов)"""
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
 
-result = test(5)
-```
+        lines = [f"{name}: {round(value, 2)}" for name, value in sorted(metrics.snapshot().items())]
+        lines.append(f"scheduler.running: {self.scheduler.running}")
+        lines.append(f"scheduler.queued: {self.scheduler.queued}")
+        lines.append(f"updates.duplicates_dropped: {self.deduplicator.duplicates_dropped}")
+        for name in sorted(self.host.bots):
+            running, queued = self.scheduler.tenant_load(name)
+            lines.append(f"tenant.{name}: running {running}, queued {queued}")
+        await update.message.reply_text("📈 Метрики\n\n" + "\n".join(lines))
+
+    async def show_top(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Рейтинг учеников и место пользователя (/top)"""
+        user_id = update.effective_user.id
+        text = rendering.render_leaderboard(
+            self.analytics.leaders(), self.analytics.rank(user_id), self.analytics.users
+        )
+        await update.message.reply_text(text)
 
-A️⃣ 5
-B️⃣ 10
-C️⃣ "55"
-D️⃣ None
+    async def show_class_stats(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Сводка по классу: выполнения и частые ошибки (только для учителей)"""
+        user_id = update.effective_user.id
+        if user_id not in self.tenant.teacher_ids and user_id not in config.ADMIN_IDS:
+            await update.message.reply_text("❌ Статистика класса доступна только учителям")
+            return
+        await update.message.reply_text(rendering.render_class_stats(self.analytics.summary()))
 
-*Ответ:* B️⃣ 10
-            """,
-            "quiz_4": """
-❓ *Вопрос 4: Что выведет код?*
+    async def manage_limits(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Просмотр и изменение ограничений на лету (только для администраторов)
 
-```python
-lst = [1, 2, 3, 4, 5]
-print(lst[2])
-```
+        /limits – текущие значения, /limits max_execution_time=3 max_output_length=1000 –
+        изменение, /limits reset – значения из config.py. Действует со следующего выполнения.
+        """
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
 
-A️⃣ 1
-B️⃣ 2
-C️⃣ 3
-D️⃣ 4
+        args = context.args or []
+        try:
+            if args == ["reset"]:
+                values = limits.reset()
+            elif args:
+                changes = {}
+                for arg in args:
+                    name, separator, value = arg.partition('=')
+                    if not separator:
+                        raise ValueError(f"ожидается имя=значение: {arg}")
+                    changes[name] = value
+                values = limits.update(**changes)
+            else:
+                limits.refresh()
+                values = limits.as_dict()
+        except (ValueError, OSError) as e:
+            await update.message.reply_text(f"❌ Ограничения не изменены: {e}")
+            return
 
-*Ответ:* C️⃣ 3 (индексация начинается с 0)
-            """,
-            "quiz_5": """
-❓ *Вопрос 5: Как получить значение из словаря?*
+        lines = [f"{name}: {value}" for name, value in values.items()]
+        await update.message.reply_text("⚙️ Ограничения\n\n" + "\n".join(lines))
 
-```python
-person = {'имя': 'Иван', 'возраст': 25}
-x = person['имя']
-```
+    async def broadcast(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Рассылка всем пользователям (только для администраторов)
 
-A️⃣ None
-B️⃣ 25
-C️⃣ 'Иван'
-D️⃣ Ошибка
+        /broadcast <текст> – новая рассылка, /broadcast – прогресс,
+        /broadcast cancel – отмена.
+        """
+        if update.effective_user.id not in config.ADMIN_IDS:
+            return
 
-*Ответ:* C️⃣ 'Иван'
-            """,
-        }
-        
-        if callback_data.startswith("lesson_"):
-            content = lessons_content.get(callback_data, "Урок не найден")
-            self.user_stats[user_id]["lessons_learned"] += 1
-        elif callback_data.startswith("quiz_"):
-            content = quiz_questions.get(callback_data, "Вопрос не найден")
+        parts = update.message.text.split(None, 1)
+        text = parts[1].strip() if len(parts) > 1 else ""
+        if text == "cancel":
+            if self.broadcaster.cancel():
+                await update.message.reply_text("⛔ Рассылка отменена")
+            else:
+                await update.message.reply_text("Нет активной рассылки")
+        elif text:
+            if self.broadcaster.start(text):
+                await update.message.reply_text(
+                    f"📣 Рассылка запущена: {len(self.registry)} получателей, "
+                    f"до {config.BROADCAST_RATE} сообщений в секунду"
+                )
+            else:
+                await update.message.reply_text("⏳ Предыдущая рассылка еще не завершена")
         else:
-            content = "Опция не найдена"
-        
-        await query.edit_message_text(content, parse_mode='Markdown')
-
-    async def handle_message(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
-        """Обработка ввода кода"""
+            state = self.broadcaster.state
+            if state is None:
+                await update.message.reply_text("Рассылок еще не было. Использование: /broadcast <текст>")
+                return
+            status = "завершена" if state["finished"] else ("идет" if self.broadcaster.active else "приостановлена")
+            await update.message.reply_text(
+                f"📣 Рассылка {status}: {state['position']} из {state['total']}, "
+                f"доставлено {state['sent']}, ошибок {state['failed']}"
+            )
+
+    async def run_long(self, update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Длительное выполнение с потоковым выводом (/run)"""
         user_id = update.effective_user.id
-        code = update.message.text
+        if user_id not in config.TRUSTED_USER_IDS:
+            await update.message.reply_text("❌ Режим /run доступен только доверенным пользователям")
+            return
 
-        # Проверка безопасности
-        quick_check = self.security.sanitize_input(code)
-        if not quick_check["is_safe"]:
-            error_msg = "❌ *Обнаружены проблемы с безопасностью:*\n" + "\n".join(quick_check["issues"][:3])
-            await update.message.reply_text(error_msg, parse_mode='Markdown')
-            if user_id in self.user_stats:
-                self.user_stats[user_id]["errors"] += 1
+        parts = update.message.text.split(None, 1)
+        code = parts[1] if len(parts) > 1 else ""
+        if not code.strip():
+            await update.message.reply_text("Использование: `/run <код>`", parse_mode='Markdown')
             return
 
-        if user_id not in self.consoles:
-            self.consoles[user_id] = PythonConsole()
+        if await self.reject_code(update, code, allow_heavy=True):
+            return
 
+        if user_id in self.active_runs:
+            await update.message.reply_text("⏳ Предыдущее выполнение еще не завершено")
+            return
+        # Отметка ставится до первого await: обновления обрабатываются параллельно
+        self.active_runs.add(user_id)
         try:
-            result = self.consoles[user_id].execute(code)
-            
-            if result.startswith(('❌', '⏰', '💥')):
-                response = result
-                if user_id in self.user_stats:
-                    self.user_stats[user_id]["errors"] += 1
-            else:
-                response = f"```python\n>>> {code}\n{result}\n```"
-                if user_id in self.user_stats:
-                    self.user_stats[user_id]["codes_executed"] += 1
-            
-            await update.message.reply_text(response, parse_mode='MarkdownV2')
-            
-        except Exception as e:
-            error_msg = f"❌ Системная ошибка:\n```\n{str(e)}\n```"
-            await update.message.reply_text(error_msg, parse_mode='MarkdownV2')
+            await self._run_streaming(update, user_id, code)
+        finally:
+            self.active_runs.discard(user_id)
+
+    async def _run_streaming(self, update: Update, user_id: int, code: str):
+        """Выполнение /run с обновлением одного сообщения по мере вывода"""
+        stop_markup = InlineKeyboardMarkup([[InlineKeyboardButton("⛔ Стоп", callback_data="stop_run")]])
+        message = await update.message.reply_text("⏳ Выполняется...", reply_markup=stop_markup)
+
+        output = []
+        started = time.monotonic()
+        task = asyncio.create_task(self.executor.run(
+            user_id, code,
+            time_limit=limits.long_execution_time,
+            output_limit=limits.long_output_length,
+            on_output=output.append
+        ))
+
+        # Одно сообщение редактируется не чаще STREAM_EDIT_INTERVAL
+        shown = 0
+        while not task.done():
+            await asyncio.wait({task}, timeout=config.STREAM_EDIT_INTERVAL)
+            if task.done() or len(output) == shown:
+                continue
+            shown = len(output)
+            try:
+                await message.edit_text(
+                    rendering.render_stream(code, ''.join(output)),
+                    parse_mode='MarkdownV2',
+                    reply_markup=stop_markup
+                )
+            except TelegramError as e:
+                logging.warning("Не удалось обновить вывод /run: %s", e)
+
+        result = task.result()
+        log_execution("run", user_id, outcome_of(result), time.monotonic() - started,
+                      code_size=len(code), output_size=sum(len(chunk) for chunk in output))
+
+        if result.startswith(('❌', '⏰', '💥', '⛔')):
+            messages = rendering.render_text(result)
             if user_id in self.user_stats:
                 self.user_stats[user_id]["errors"] += 1
+        else:
+            messages = rendering.render_execution(code, result, max_length=limits.long_output_length)
+            if user_id in self.user_stats:
+                self.user_stats[user_id]["codes_executed"] += 1
+
+        await message.edit_text(messages[0], parse_mode='MarkdownV2')
+        for extra in messages[1:]:
+            await update.message.reply_text(extra, parse_mode='MarkdownV2')
 
     async def error_handler(self, update: object, context: ContextTypes.DEFAULT_TYPE) -> None:
         """Обработчик ошибок"""
         logging.error(msg="Exception while handling an update:", exc_info=context.error)
 
     def run(self):
-        """Запуск бота"""
-        if self.webhook_url:
-            self.run_webhook()
-        else:
-            self.run_polling()
-
-    def run_webhook(self):
-        """Запуск в режиме webhook"""
-        self.application.run_webhook(
-            listen="0.0.0.0",
-            port=self.port,
-            url_path=self.token,
-            webhook_url=f"{self.webhook_url}/{self.token}"
-        )
-
-    def run_polling(self):
-        """Запуск в режиме polling (для разработки)"""
-        self.application.run_polling()
+        """Запуск бота (и остальных ботов, добавленных в тот же BotHost)"""
+        self.host.run()
@@ -0,0 +1,247 @@
+import asyncio
+import json
+import logging
+import os
+import time
+
+from telegram.error import BadRequest, Forbidden, NetworkError, RetryAfter, TelegramError
+
+from metrics import metrics
+
+
+class UserRegistry:
+    """Сохраняемый на диск список всех пользователей бота
+
+    Файл дописывается по одной строке на нового пользователя, поэтому
+    регистрация – O(1), а порядок пользователей не меняется. Порядок важен
+    для рассылок: прогресс рассылки – это позиция в этом списке.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.users = []  # user_id в порядке регистрации
+        self._known = set()
+        self._load()
+
+    def _load(self):
+        if not self.path:
+            return
+        try:
+            with open(self.path, encoding='utf-8') as f:
+                for line in f:
+                    try:
+                        user_id = int(line)
+                    except ValueError:
+                        # Недописанная строка после аварийной остановки
+                        continue
+                    if user_id not in self._known:
+                        self._known.add(user_id)
+                        self.users.append(user_id)
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.warning("Не удалось прочитать реестр пользователей: %s", e)
+
+    def __len__(self) -> int:
+        return len(self.users)
+
+    def register(self, user_id: int) -> bool:
+        """Добавление пользователя; True – пользователь новый"""
+        if user_id in self._known:
+            return False
+        self._known.add(user_id)
+        self.users.append(user_id)
+        if self.path:
+            try:
+                directory = os.path.dirname(self.path)
+                if directory:
+                    os.makedirs(directory, exist_ok=True)
+                with open(self.path, 'a', encoding='utf-8') as f:
+                    f.write(f"{user_id}\n")
+            except OSError as e:
+                logging.warning("Не удалось сохранить пользователя в реестре: %s", e)
+        return True
+
+
+class Broadcaster:
+    """Рассылка объявлений всем пользователям из реестра
+
+    Сообщения отправляются по одному не чаще `rate` в секунду. После каждой
+    отправки позиция сохраняется на диск, поэтому после перезапуска рассылка
+    продолжается со следующего получателя. Пока `is_busy()` истинно (есть
+    очередь живых запросов), рассылка ждет.
+    """
+
+    def __init__(self, bot, registry: UserRegistry, state_file: str = None,
+                 rate: float = 20.0, is_busy=None):
+        self.bot = bot
+        self.registry = registry
+        self.state_file = state_file
+        self.rate = rate
+        self.is_busy = is_busy or (lambda: False)
+        self.state = self._load_state()
+        self._task = None
+        self._stopping = False
+
+    def _load_state(self):
+        if not self.state_file:
+            return None
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+        except (ValueError, OSError) as e:
+            logging.warning("Не удалось прочитать состояние рассылки: %s", e)
+            return None
+
+    def _save_state(self, state: dict):
+        """Атомарная запись прогресса"""
+        if not self.state_file:
+            return
+        try:
+            directory = os.path.dirname(self.state_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.state_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump(state, f, ensure_ascii=False)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logging.warning("Не удалось сохранить прогресс рассылки: %s", e)
+
+    @property
+    def active(self) -> bool:
+        """Идет ли рассылка"""
+        return self._task is not None and not self._task.done()
+
+    def start(self, text: str) -> bool:
+        """Новая рассылка всем, кто есть в реестре сейчас; False – уже идет другая"""
+        if self.active:
+            return False
+        self.state = {
+            "text": text,
+            "total": len(self.registry),  # Новые пользователи в рассылку не попадают
+            "position": 0,
+            "sent": 0,
+            "failed": 0,
+            "started_at": time.time(),
+            "finished": False,
+        }
+        self._save_state(self.state)
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    def resume(self) -> bool:
+        """Продолжение незавершенной рассылки после перезапуска"""
+        if self.active or self.state is None or self.state.get("finished"):
+            return False
+        logging.info("Продолжение рассылки с позиции %s из %s", self.state["position"], self.state["total"])
+        self._stopping = False
+        self._task = asyncio.create_task(self._run())
+        return True
+
+    async def stop(self, timeout: float = 5.0):
+        """Остановка рассылки после текущего сообщения; ее можно продолжить
+
+        Если сообщение не отправилось за `timeout`, задача отменяется.
+        """
+        if not self.active:
+            return
+        self._stopping = True
+        try:
+            await asyncio.wait_for(asyncio.shield(self._task), timeout)
+        except asyncio.TimeoutError:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+
+    def cancel(self) -> bool:
+        """Отмена рассылки без продолжения"""
+        if self.state is None or self.state.get("finished"):
+            return False
+        if self.active:
+            self._task.cancel()
+        self.state["finished"] = True
+        self._save_state(self.state)
+        return True
+
+    async def _run(self):
+        state = self.state
+        loop = asyncio.get_running_loop()
+        interval = 1.0 / self.rate
+        try:
+            while state["position"] < state["total"] and not state["finished"]:
+                # Живые запросы пользователей важнее рассылки
+                while self.is_busy() and not self._stopping:
+                    await asyncio.sleep(interval)
+                if self._stopping:
+                    return
+
+                started = time.monotonic()
+                user_id = self.registry.users[state["position"]]
+                sent = await self._send(user_id, state["text"])
+                if sent is None:
+                    # Остановка во время повторов: получатель остается следующим
+                    return
+                if sent:
+                    state["sent"] += 1
+                else:
+                    state["failed"] += 1
+                state["position"] += 1
+                # Прогресс пишется до следующей отправки: после сбоя
+                # повторно может уйти только сообщение, прерванное на лету
+                await loop.run_in_executor(None, self._save_state, dict(state))
+
+                await asyncio.sleep(max(0.0, interval - (time.monotonic() - started)))
+
+            state["finished"] = True
+            self._save_state(state)
+            metrics.increment("broadcasts_completed")
+            logging.info("Рассылка завершена: отправлено %s, ошибок %s", state["sent"], state["failed"])
+        except asyncio.CancelledError:
+            self._save_state(state)
+            raise
+
+    async def _send(self, user_id: int, text: str, max_backoff: float = 60.0):
+        """Отправка одного сообщения с ожиданием при ограничении частоты
+
+        Сетевые ошибки (NetworkError, TimedOut) повторяются с растущей паузой,
+        неудачей считаются только постоянные ошибки (Forbidden, BadRequest).
+        True – отправлено, False – не отправить, None – рассылку остановили.
+        """
+        backoff = 1.0
+        while True:
+            try:
+                await self.bot.send_message(chat_id=user_id, text=text)
+                metrics.increment("broadcast_sent")
+                return True
+            except RetryAfter as e:
+                metrics.increment("broadcast_throttled")
+                retry_after = e.retry_after
+                if not isinstance(retry_after, (int, float)):
+                    retry_after = retry_after.total_seconds()
+                await asyncio.sleep(retry_after)
+            except Forbidden:
+                # Пользователь заблокировал бота
+                metrics.increment("broadcast_failed")
+                return False
+            except BadRequest as e:
+                # Чат не найден, удален и т.п. – повтор не поможет
+                logging.warning("Рассылка: не удалось отправить сообщение %s: %s", user_id, e)
+                metrics.increment("broadcast_failed")
+                return False
+            except NetworkError as e:
+                metrics.increment("broadcast_retries")
+                logging.warning("Рассылка: сетевая ошибка, повтор через %s с: %s", backoff, e)
+                await asyncio.sleep(backoff)
+                backoff = min(backoff * 2, max_backoff)
+            except TelegramError as e:
+                logging.warning("Рассылка: не удалось отправить сообщение %s: %s", user_id, e)
+                metrics.increment("broadcast_failed")
+                return False
+            if self._stopping:
+                return None
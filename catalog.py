@@ -0,0 +1,298 @@
+import json
+import logging
+
+# Встроенный каталог: уроки и вопросы викторины (ключ – callback_data кнопки)
+LESSON_TITLES = {
+    "lesson_1": "1️⃣ Переменные и типы данных",
+    "lesson_2": "2️⃣ Условные операторы",
+    "lesson_3": "3️⃣ Циклы",
+    "lesson_4": "4️⃣ Функции",
+    "lesson_5": "5️⃣ Списки и словари",
+}
+
+LESSONS = {
+    "lesson_1": """
+*📖 Урок 1: Переменные и типы данных*
+
+Переменная – это имя, которое хранит значение.
+
+```python
+# Строка (str)
+name = 'Python'
+greeting = "Hello, World!"
+
+# Целое число (int)
+age = 30
+count = 100
+
+# Число с плавающей точкой (float)
+height = 5.9
+price = 19.99
+
+# Булево значение (bool)
+is_active = True
+is_closed = False
+
+# Проверка типа
+print(type(name))      # <class 'str'>
+print(type(age))       # <class 'int'>
+print(type(height))    # <class 'float'>
+print(type(is_active)) # <class 'bool'>
+```
+
+*Задание:* Создайте переменные для вашего профиля!
+    """,
+    "lesson_2": """
+*📖 Урок 2: Условные операторы*
+
+Условные операторы позволяют выполнять различный код в зависимости от условия.
+
+```python
+age = 18
+
+# if-else
+if age >= 18:
+    print('Вы взрослый')
+else:
+    print('Вы несовершеннолетний')
+
+# if-elif-else
+if age < 13:
+    print('Вы ребенок')
+elif age < 18:
+    print('Вы подросток')
+else:
+    print('Вы взрослый')
+
+# Логические операторы
+if age > 18 and age < 65:
+    print('Работающий возраст')
+```
+
+*Задание:* Напишите условие для проверки четности числа!
+    """,
+    "lesson_3": """
+*📖 Урок 3: Циклы*
+
+Циклы повторяют код несколько раз.
+
+```python
+# Цикл for
+for i in range(5):
+    print(i)  # 0, 1, 2, 3, 4
+
+# Цикл while
+count = 0
+while count < 3:
+    print(count)
+    count += 1
+
+# Перебор списка
+fruits = ['яблоко', 'банан', 'апельсин']
+for fruit in fruits:
+    print(fruit)
+
+# range с параметрами
+for i in range(1, 10, 2):  # от 1 до 10, шаг 2
+    print(i)  # 1, 3, 5, 7, 9
+```
+
+*Задание:* Выведите таблицу умножения на 5!
+    """,
+    "lesson_4": """
+*📖 Урок 4: Функции*
+
+Функции – это блоки кода, которые можно переиспользовать.
+
+```python
+# Простая функция
+def greet():
+    return 'Привет!'
+
+print(greet())
+
+# Функция с параметрами
+def add(a, b):
+    return a + b
+
+result = add(5, 3)
+print(result)  # 8
+
+# Функция с несколькими параметрами
+def calculate(x, y, operation):
+    if operation == '+':
+        return x + y
+    elif operation == '-':
+        return x - y
+    elif operation == '*':
+        return x * y
+
+print(calculate(10, 5, '*'))  # 50
+```
+
+*Задание:* Напишите функцию для вычисления площади прямоугольника!
+    """,
+    "lesson_5": """
+*📖 Урок 5: Списки и словари*
+
+Списки и словари – это коллекции данных.
+
+```python
+# Список
+fruits = ['яблоко', 'банан', 'апельсин']
+numbers = [1, 2, 3, 4, 5]
+
+# Доступ к элементам
+print(fruits[0])    # яблоко
+print(fruits[-1])   # апельсин
+
+# Методы списков
+fruits.append('груша')
+fruits.remove('банан')
+print(len(fruits))  # 3
+
+# Словарь
+person = {
+    'имя': 'Иван',
+    'возраст': 25,
+    'город': 'Москва'
+}
+
+# Доступ к словарю
+print(person['имя'])      # Иван
+print(person.get('возраст'))  # 25
+
+# Добавление элемента
+person['профессия'] = 'Программист'
+```
+
+*Задание:* Создайте словарь своего контакта!
+    """,
+}
+
+QUIZ_TITLES = {
+    "quiz_1": "❓ Вопрос 1: Типы данных",
+    "quiz_2": "❓ Вопрос 2: Цикл for",
+    "quiz_3": "❓ Вопрос 3: Функции",
+    "quiz_4": "❓ Вопрос 4: Списки",
+    "quiz_5": "❓ Вопрос 5: Словари",
+}
+
+QUIZ = {
+    "quiz_1": """
+❓ *Вопрос 1: Какой это тип данных?*
+
+```python
+x = 3.14
+```
+
+A️⃣ int (целое число)
+B️⃣ float (число с плавающей точкой)
+C️⃣ str (строка)
+D️⃣ bool (булево значение)
+
+*Ответ:* B️⃣ float
+    """,
+    "quiz_2": """
+❓ *Вопрос 2: Сколько раз выполнится цикл?*
+
+```python
+for i in range(3):
+    print(i)
+```
+
+A️⃣ 2 раза
+B️⃣ 3 раза
+C️⃣ 4 раза
+D️⃣ Бесконечный цикл
+
+*Ответ:* B️⃣ 3 раза (0, 1, 2)
+    """,
+    "quiz_3": """
+❓ *Вопрос 3: Что вернет функция?*
+
+```python
+def test(x):
+    return x * 2
+
+result = test(5)
+```
+
+A️⃣ 5
+B️⃣ 10
+C️⃣ "55"
+D️⃣ None
+
+*Ответ:* B️⃣ 10
+    """,
+    "quiz_4": """
+❓ *Вопрос 4: Что выведет код?*
+
+```python
+lst = [1, 2, 3, 4, 5]
+print(lst[2])
+```
+
+A️⃣ 1
+B️⃣ 2
+C️⃣ 3
+D️⃣ 4
+
+*Ответ:* C️⃣ 3 (индексация начинается с 0)
+    """,
+    "quiz_5": """
+❓ *Вопрос 5: Как получить значение из словаря?*
+
+```python
+person = {'имя': 'Иван', 'возраст': 25}
+x = person['имя']
+```
+
+A️⃣ None
+B️⃣ 25
+C️⃣ 'Иван'
+D️⃣ Ошибка
+
+*Ответ:* C️⃣ 'Иван'
+    """,
+}
+
+
+class Catalog:
+    """Учебные материалы бота: уроки и викторина
+
+    У каждого бота (класса) может быть свой каталог в JSON:
+    {"lessons": [{"title": ..., "content": ...}], "quiz": [...]}.
+    Без файла используется встроенный каталог.
+    """
+
+    def __init__(self, lessons: dict = None, lesson_titles: dict = None,
+                 quiz: dict = None, quiz_titles: dict = None):
+        self.lessons = LESSONS if lessons is None else lessons
+        self.lesson_titles = LESSON_TITLES if lesson_titles is None else lesson_titles
+        self.quiz = QUIZ if quiz is None else quiz
+        self.quiz_titles = QUIZ_TITLES if quiz_titles is None else quiz_titles
+
+    @classmethod
+    def load(cls, path: str = None) -> "Catalog":
+        """Каталог из файла; при ошибке – встроенный"""
+        if not path:
+            return cls()
+        try:
+            with open(path, encoding='utf-8') as f:
+                data = json.load(f)
+            lessons, lesson_titles = cls._section(data.get("lessons", []), "lesson")
+            quiz, quiz_titles = cls._section(data.get("quiz", []), "quiz")
+        except (OSError, ValueError, KeyError, TypeError, AttributeError) as e:
+            logging.warning("Каталог %s не загружен, используется встроенный: %s", path, e)
+            return cls()
+        return cls(lessons, lesson_titles, quiz, quiz_titles)
+
+    @staticmethod
+    def _section(items: list, prefix: str) -> tuple:
+        contents, titles = {}, {}
+        for number, item in enumerate(items, 1):
+            key = f"{prefix}_{number}"
+            titles[key] = item["title"]
+            contents[key] = item["content"]
+        return contents, titles
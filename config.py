@@ -7,7 +7,103 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 MAX_CODE_LENGTH = 1000
 MAX_OUTPUT_LENGTH = 2000
 MAX_EXECUTION_TIME = 5
+# Запас памяти процесса-исполнителя сверх интерпретатора; общий для закрепленных за ним пользователей
+MAX_MEMORY_MB = 50
 
 # Настройки Webhook для Render
 WEBHOOK_URL = os.getenv('WEBHOOK_URL', '')
 PORT = int(os.getenv('PORT', 10000))
+
+# Каталог для состояния, переживающего перезапуск
+STATE_DIR = os.getenv('STATE_DIR', '.state')
+
+# Дедупликация повторно доставленных обновлений
+DEDUP_CAPACITY = 4096
+DEDUP_STATE_FILE = os.path.join(STATE_DIR, 'update_high_water_mark.json')
+# Отметка не используется, если она старше суток или новый update_id ниже ее больше чем на MAX_GAP
+# (после недели без обновлений Telegram выбирает следующий update_id случайно)
+DEDUP_MAX_AGE = 24 * 3600
+DEDUP_MAX_GAP = 100_000
+
+# Пул песочниц: число долгоживущих процессов-исполнителей
+EXECUTOR_WORKERS = int(os.getenv('EXECUTOR_WORKERS', 2))
+# Как часто (в выполнениях) воркер присылает снимок сессии
+SNAPSHOT_EVERY = 5
+# Запас времени сверх таймаута, после которого воркер считается зависшим
+EXECUTOR_GRACE_SECONDS = 2
+# Консолей в памяти одного воркера (остальные поднимаются из снимков) и сессий в родителе
+WORKER_MAX_SESSIONS = 200
+MAX_SESSIONS = 20000
+
+# Режим /run: длительное выполнение с потоковым выводом (только доверенные пользователи)
+TRUSTED_USER_IDS = {int(user_id) for user_id in os.getenv('TRUSTED_USER_IDS', '').split(',') if user_id.strip()}
+LONG_EXECUTION_TIME = 60
+LONG_OUTPUT_LENGTH = 16000
+STREAM_EDIT_INTERVAL = 1.0
+
+# Планировщик: сколько песочниц могут занять задачи /run и через сколько
+# секунд ожидания они получают слот вне очереди
+SCHEDULER_LONG_CAPACITY = 1
+SCHEDULER_AGING_SECONDS = 10
+
+# Общий кэш результатов чистых выражений (число записей и суммарный размер в символах)
+PURE_CACHE_SIZE = 2048
+PURE_CACHE_MAX_CHARS = 4 * 1024 * 1024
+
+# Статическая оценка стоимости кода
+COST_MAX_ITERATIONS = 10_000_000
+COST_MAX_POWER_BITS = 1_000_000
+COST_MAX_REPEAT = 10_000_000
+# Константы длиннее этого числа бит при оценке не вычисляются (считаются бесконечными)
+COST_MAX_CONST_BITS = 65536
+
+# Администраторы (через запятую): команды /metrics и другие служебные
+ADMIN_IDS = {int(user_id) for user_id in os.getenv('ADMIN_IDS', '').split(',') if user_id.strip()}
+
+# /trace: максимум записанных шагов и число хранимых трассировок
+TRACE_MAX_STEPS = 200
+TRACE_CACHE_USERS = 1000
+
+# Блокнот (/cell, /edit): максимум ячеек в сессии
+NOTEBOOK_MAX_CELLS = 20
+
+# Логирование: очередь в фоновый поток, события выполнения в JSON lines
+LOG_LEVEL = os.getenv('LOG_LEVEL', 'INFO')
+LOG_SALT = os.getenv('LOG_SALT', '')
+LOG_QUEUE_SIZE = 10000
+# При заполнении очереди выше порога успешные события пишутся 1 из LOG_SAMPLE_RATE
+LOG_SAMPLE_THRESHOLD = 1000
+LOG_SAMPLE_RATE = 10
+EVENT_LOG_FILE = os.path.join(STATE_DIR, 'events.jsonl')
+EVENT_LOG_MAX_BYTES = 10 * 1024 * 1024
+EVENT_LOG_BACKUPS = 3
+
+# Рейтинг и аналитика класса: размер /top и число типов ошибок в /class_stats
+LEADERBOARD_SIZE = 10
+CLASS_STATS_TOP_ERRORS = 5
+# Учителя (через запятую): доступ к /class_stats (администраторам доступ есть всегда)
+TEACHER_IDS = {int(user_id) for user_id in os.getenv('TEACHER_IDS', '').split(',') if user_id.strip()}
+
+# Рассылки (/broadcast): реестр пользователей, прогресс и темп (сообщений в секунду)
+USER_REGISTRY_FILE = os.path.join(STATE_DIR, 'users.txt')
+BROADCAST_STATE_FILE = os.path.join(STATE_DIR, 'broadcast.json')
+BROADCAST_RATE = 20
+
+# Переопределения ограничений (/limits или правка файла) применяются без перезапуска
+LIMITS_FILE = os.path.join(STATE_DIR, 'limits.json')
+
+# Проверки состояния (/healthz, /readyz); отвечают на том же порту, что и webhook
+LOOP_LAG_INTERVAL = 0.5
+# Бот не готов, если цикл событий опаздывает или очередь к песочницам длиннее порога
+HEALTH_MAX_LOOP_LAG = 1.0
+HEALTH_MAX_QUEUED = 100
+
+# Плавная остановка по SIGTERM: срок на завершение обработки и сохраняемые данные
+DRAIN_TIMEOUT = 20
+SESSIONS_FILE = os.path.join(STATE_DIR, 'sessions.pickle')
+STATS_FILE = os.path.join(STATE_DIR, 'stats.json')
+
+# Несколько ботов в одном процессе: JSON-файл со списком ботов (без файла – один бот с BOT_TOKEN)
+TENANTS_FILE = os.getenv('TENANTS_FILE', '')
+# Кэш скомпилированного кода в каждом процессе-исполнителе (число записей)
+COMPILE_CACHE_SIZE = 1024
@@ -0,0 +1,223 @@
+import ast
+import math
+
+import config
+
+# Вердикты: код выполняется, уходит только в /run, или отклоняется сразу
+OK = "ok"
+HEAVY = "heavy"
+REJECT = "reject"
+
+_UNKNOWN = None
+
+# Функции, которые проходят по переданному range() целиком
+_CONSUMERS = frozenset({'list', 'tuple', 'set', 'sum', 'sorted', 'max', 'min', 'any', 'all'})
+
+
+class CostChecker:
+    """Дешевая статическая оценка стоимости кода до запуска песочницы
+
+    Ловит шаблоны, которые гарантированно сжигают весь таймаут или память:
+    бесконечные циклы без выхода, огромное возведение в степень, гигантские
+    range() и повторения, рекурсию без базового случая.
+    """
+
+    def __init__(self, max_iterations: int = config.COST_MAX_ITERATIONS,
+                 max_power_bits: int = config.COST_MAX_POWER_BITS,
+                 max_repeat: int = config.COST_MAX_REPEAT,
+                 max_const_bits: int = config.COST_MAX_CONST_BITS):
+        self.max_iterations = max_iterations
+        self.max_power_bits = max_power_bits
+        self.max_repeat = max_repeat
+        self.max_const_bits = max_const_bits
+        self._folded = {}  # id(узел) -> свернутое значение (на время одной проверки)
+
+    def check(self, code: str) -> dict:
+        """Оценка кода: {"verdict": ok|heavy|reject, "issues": [...], "reasons": [...]}"""
+        try:
+            tree = ast.parse(code)
+        except SyntaxError:
+            # Синтаксис проверяет SecurityManager
+            return {"verdict": OK, "issues": [], "reasons": []}
+
+        findings = []  # (вердикт, причина, сообщение)
+        self._folded = {}
+        try:
+            self._check_loops(tree, 1, findings)
+            for node in ast.walk(tree):
+                if isinstance(node, ast.BinOp):
+                    self._check_binop(node, findings)
+                elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef)):
+                    self._check_recursion(node, findings)
+        finally:
+            self._folded = {}
+
+        verdict = OK
+        if any(level == HEAVY for level, _, _ in findings):
+            verdict = HEAVY
+        if any(level == REJECT for level, _, _ in findings):
+            verdict = REJECT
+        return {
+            "verdict": verdict,
+            "issues": [message for _, _, message in findings],
+            "reasons": [reason for _, reason, _ in findings]
+        }
+
+    def _const(self, node):
+        """Значение целочисленной константы или None; float('inf') – астрономически большое
+
+        Проверка идет в цикле событий, поэтому числа длиннее max_const_bits
+        не строятся: размер результата оценивается по bit_length() заранее,
+        а свернутые значения запоминаются на время проверки.
+        """
+        key = id(node)
+        if key not in self._folded:
+            self._folded[key] = self._fold(node)
+        return self._folded[key]
+
+    def _fold(self, node):
+        if isinstance(node, ast.Constant) and isinstance(node.value, int):
+            if node.value.bit_length() > self.max_const_bits:
+                return math.inf
+            return node.value
+        if isinstance(node, ast.UnaryOp) and isinstance(node.op, ast.USub):
+            value = self._const(node.operand)
+            return -value if value is not None else _UNKNOWN
+        if isinstance(node, ast.BinOp):
+            left = self._const(node.left)
+            right = self._const(node.right)
+            if left is None or right is None:
+                return _UNKNOWN
+            if math.inf in (left, right, -left, -right):
+                return math.inf
+            if isinstance(node.op, ast.Pow):
+                if right < 0:
+                    return _UNKNOWN
+                if self._power_bits(left, right) > self.max_const_bits:
+                    return math.inf
+                return left ** right
+            if isinstance(node.op, (ast.Add, ast.Sub)):
+                if max(left.bit_length(), right.bit_length()) + 1 > self.max_const_bits:
+                    return math.inf
+                return left + right if isinstance(node.op, ast.Add) else left - right
+            if isinstance(node.op, ast.Mult):
+                if left.bit_length() + right.bit_length() > self.max_const_bits:
+                    return math.inf
+                return left * right
+            if isinstance(node.op, ast.FloorDiv) and right:
+                return left // right
+        return _UNKNOWN
+
+    @staticmethod
+    def _power_bits(base, exponent) -> float:
+        """Оценка размера base ** exponent в битах"""
+        if abs(base) <= 1 or exponent <= 0:
+            return 0
+        # Показатель длиннее ~1000 бит не переводится во float (OverflowError)
+        if exponent == math.inf or exponent.bit_length() > 1000:
+            return math.inf
+        return exponent * math.log2(abs(base))
+
+    def _check_binop(self, node: ast.BinOp, findings: list):
+        """Огромные степени и повторения последовательностей"""
+        if isinstance(node.op, ast.Pow):
+            base = self._const(node.left)
+            exponent = self._const(node.right)
+            if base is not None and exponent is not None and self._power_bits(base, exponent) > self.max_power_bits:
+                findings.append((REJECT, "huge_power", "❌ Слишком большое возведение в степень"))
+        elif isinstance(node.op, ast.Mult):
+            for sequence, count in ((node.left, node.right), (node.right, node.left)):
+                if not isinstance(sequence, (ast.Constant, ast.List, ast.Tuple)):
+                    continue
+                if isinstance(sequence, ast.Constant) and not isinstance(sequence.value, (str, bytes)):
+                    continue
+                times = self._const(count)
+                if times is None:
+                    continue
+                size = len(sequence.value) if isinstance(sequence, ast.Constant) else len(sequence.elts)
+                if times * max(size, 1) > self.max_repeat:
+                    findings.append((REJECT, "huge_repeat", "❌ Слишком большое повторение последовательности"))
+                    return
+
+    def _range_length(self, node):
+        """Число итераций range() с константными аргументами"""
+        if not (isinstance(node, ast.Call) and isinstance(node.func, ast.Name) and node.func.id == 'range'):
+            return _UNKNOWN
+        args = [self._const(arg) for arg in node.args]
+        if not args or _UNKNOWN in args or len(args) > 3:
+            return _UNKNOWN
+        # Бесконечность любого знака: range(-(10**70000), 0) тоже астрономический
+        if any(isinstance(arg, float) and not math.isfinite(arg) for arg in args):
+            return math.inf
+        start, stop, step = (0, args[0], 1) if len(args) == 1 else (args + [1])[:3]
+        if step == 0:
+            return _UNKNOWN
+        return max(0, (stop - start + step - (1 if step > 0 else -1)) // step)
+
+    def _check_loops(self, node, multiplier, findings: list):
+        """Рекурсивный обход циклов с учетом вложенности"""
+        for child in ast.iter_child_nodes(node):
+            inner = multiplier
+            if isinstance(child, ast.For):
+                length = self._range_length(child.iter)
+                if length is not None:
+                    inner = multiplier * length
+                    if inner > self.max_iterations:
+                        findings.append((HEAVY, "huge_range", "⚠️ Слишком много итераций цикла"))
+                        continue
+            elif isinstance(child, ast.While):
+                test = child.test
+                always_true = isinstance(test, ast.Constant) and bool(test.value)
+                if always_true and not self._has_exit(child.body):
+                    findings.append((HEAVY, "infinite_loop", "⚠️ Бесконечный цикл без break"))
+                    continue
+            elif isinstance(child, (ast.ListComp, ast.SetComp, ast.DictComp, ast.GeneratorExp)):
+                for generator in child.generators:
+                    length = self._range_length(generator.iter)
+                    if length is not None:
+                        inner *= length
+                if inner > self.max_iterations:
+                    findings.append((HEAVY, "huge_range", "⚠️ Слишком много итераций цикла"))
+                    continue
+            elif (isinstance(child, ast.Call) and isinstance(child.func, ast.Name)
+                  and child.func.id in _CONSUMERS and child.args):
+                length = self._range_length(child.args[0])
+                if length is not None and multiplier * length > self.max_iterations:
+                    # list(range(10**9)), sum(range(...)) и т.п.
+                    findings.append((HEAVY, "huge_range", "⚠️ Слишком большой range()"))
+                    continue
+            self._check_loops(child, inner, findings)
+
+    @staticmethod
+    def _has_exit(body) -> bool:
+        """Есть ли в теле цикла break/return/raise (break вложенных циклов не считается)"""
+        stack = list(body)
+        while stack:
+            node = stack.pop()
+            if isinstance(node, (ast.Break, ast.Return, ast.Raise)):
+                return True
+            if isinstance(node, (ast.For, ast.While, ast.AsyncFor)):
+                # break внутри вложенного цикла завершает только его
+                stack.extend(node.orelse)
+                stack.extend(
+                    child for child in ast.walk(ast.Module(body=node.body, type_ignores=[]))
+                    if isinstance(child, (ast.Return, ast.Raise))
+                )
+                continue
+            if isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef, ast.Lambda)):
+                continue
+            stack.extend(ast.iter_child_nodes(node))
+        return False
+
+    @staticmethod
+    def _check_recursion(node, findings: list):
+        """Функция, вызывающая себя без какого-либо условия"""
+        calls_itself = False
+        has_condition = False
+        for child in ast.walk(node):
+            if isinstance(child, ast.Call) and isinstance(child.func, ast.Name) and child.func.id == node.name:
+                calls_itself = True
+            elif isinstance(child, (ast.If, ast.IfExp, ast.BoolOp, ast.While, ast.For, ast.Try, ast.Match)):
+                has_condition = True
+        if calls_itself and not has_condition:
+            findings.append((REJECT, "unbounded_recursion", f"❌ Рекурсия без базового случая в `{node.name}`"))
@@ -0,0 +1,621 @@
+import asyncio
+import io
+import logging
+import multiprocessing
+import os
+import pickle
+import signal
+import time
+from collections import OrderedDict
+from contextlib import nullcontext
+
+import config
+from limits import limits
+from metrics import metrics
+from pure_cache import PureResultCache, bound_names, is_pure_expression, references_originals
+from python_console import ExecutionCancelled, PythonConsole
+from scheduler import Priority, current_priority
+from security import SecurityManager
+
+
+class _StreamingOutput(io.StringIO):
+    """stdout воркера в режиме /run: копит вывод и пересылает его порциями
+
+    Объем сохраняемого и пересылаемого вывода ограничен `limit` символами.
+    """
+
+    def __init__(self, conn, limit: int, interval: float = 0.25):
+        super().__init__()
+        self.conn = conn
+        self.limit = limit
+        self.interval = interval
+        self._size = 0
+        self._pending = []
+        self._last_sent = 0.0
+
+    def write(self, text: str) -> int:
+        if self._size >= self.limit:
+            return len(text)
+        text = text[:self.limit - self._size]
+        self._size += len(text)
+        self._pending.append(text)
+        super().write(text)
+        if time.monotonic() - self._last_sent >= self.interval:
+            self.send_pending()
+        return len(text)
+
+    def send_pending(self):
+        """Отправка накопленного вывода родительскому процессу"""
+        if self._pending:
+            self.conn.send({"chunk": ''.join(self._pending)})
+            self._pending = []
+        self._last_sent = time.monotonic()
+
+
+def _cancel_handler(signum, frame):
+    """SIGINT прерывает только идущее выполнение /run"""
+    if _cancel_handler.armed:
+        raise ExecutionCancelled()
+
+_cancel_handler.armed = False
+
+
+def _worker_main(conn, snapshot_every: int, max_consoles: int):
+    """Цикл процесса-исполнителя: консоли пользователей живут здесь
+
+    По IPC приходит только код, обратно уходит только результат.
+    Раз в `snapshot_every` выполнений к ответу прикладывается дельта снимка
+    сессии: только переменные, изменившиеся с прошлого снимка.
+
+    В процессе живут не больше `max_consoles` консолей: давно не
+    использованные вытесняются, а их последняя дельта уходит родителю
+    в поле "evicted". При следующем обращении консоль восстанавливается
+    из снимка родителя.
+    """
+    consoles = OrderedDict()  # user_id -> PythonConsole, от давно не использованных к недавним
+
+    def console_for(user_id) -> PythonConsole:
+        console = consoles.get(user_id)
+        if console is None:
+            console = consoles[user_id] = PythonConsole()
+        consoles.move_to_end(user_id)
+        return console
+
+    # Нетронутое пространство имен: с ним сверяются имена перед кэшированием результата
+    original_globals = SecurityManager().create_safe_globals()
+    signal.signal(signal.SIGINT, _cancel_handler)
+
+    while True:
+        try:
+            op, user_id, payload = conn.recv()
+        except (EOFError, KeyboardInterrupt):
+            break
+
+        reply = {"result": None, "snapshot": None}
+        try:
+            if op == "execute":
+                code, pure = payload
+                console = console_for(user_id)
+                reply["result"] = console.execute(code)
+                reply["error_type"] = console.last_error_type
+                # Результат можно разделить, только если все имена – исходные объекты
+                reply["cacheable"] = (
+                    pure and console.last_error_type is None
+                    and references_originals(code, console.local_vars, original_globals)
+                )
+                if console.execution_count % snapshot_every == 0:
+                    reply["snapshot"] = console.snapshot_delta()
+            elif op == "run":
+                code, time_limit, output_limit = payload
+                console = console_for(user_id)
+                stream = _StreamingOutput(conn, output_limit)
+                _cancel_handler.armed = True
+                try:
+                    reply["result"] = console.execute(code, time_limit=time_limit, stdout=stream)
+                    reply["error_type"] = console.last_error_type
+                except ExecutionCancelled:
+                    reply["result"] = "⛔ Выполнение остановлено"
+                    reply["error_type"] = "Cancelled"
+                finally:
+                    _cancel_handler.armed = False
+                stream.send_pending()
+                if console.execution_count % snapshot_every == 0:
+                    reply["snapshot"] = console.snapshot_delta()
+            elif op == "trace":
+                console = console_for(user_id)
+                reply["result"] = console.trace(payload, max_steps=config.TRACE_MAX_STEPS)
+            elif op == "notebook":
+                action, args = payload
+                if action not in ("add", "edit", "listing"):
+                    raise ValueError(f"неизвестная команда блокнота: {action}")
+                console = console_for(user_id)
+                reply["result"] = getattr(console.notebook, action)(*args)
+                if console.execution_count % snapshot_every == 0:
+                    reply["snapshot"] = console.snapshot_delta()
+            elif op == "reset":
+                console = console_for(user_id)
+                reply["result"] = console.reset_console()
+            elif op == "checkpoint":
+                # Дельты снимков всех консолей воркера (перед остановкой бота)
+                reply["result"] = {uid: console.snapshot_delta() for uid, console in consoles.items()}
+            elif op == "restore":
+                consoles.pop(user_id, None)
+                console = console_for(user_id)
+                if payload is not None:
+                    console.restore(payload)
+        except Exception as e:
+            reply["result"] = f"❌ Ошибка выполнения: {str(e)}"
+
+        while len(consoles) > max_consoles:
+            evicted_id, evicted = consoles.popitem(last=False)
+            reply.setdefault("evicted", {})[evicted_id] = evicted.snapshot_delta()
+
+        conn.send(reply)
+
+
+class WorkerCrashed(Exception):
+    """Процесс-исполнитель завис или завершился"""
+    pass
+
+
+class _Worker:
+    """Долгоживущий процесс-исполнитель и его канал"""
+
+    def __init__(self, context, snapshot_every: int, max_consoles: int):
+        self.conn, child_conn = context.Pipe()
+        self.process = context.Process(
+            target=_worker_main,
+            args=(child_conn, snapshot_every, max_consoles),
+            daemon=True
+        )
+        self.process.start()
+        child_conn.close()
+        self.lock = asyncio.Lock()
+        self.users = set()  # Пользователи, чьи консоли уже живут в процессе
+
+    def call(self, message: tuple, timeout: float) -> dict:
+        """Блокирующий запрос к воркеру (выполняется в пуле потоков)"""
+        try:
+            self.conn.send(message)
+            if not self.conn.poll(timeout):
+                raise WorkerCrashed("timeout")
+            return self.conn.recv()
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(str(e))
+
+    def call_streaming(self, message: tuple, timeout: float, on_chunk) -> dict:
+        """Блокирующий запрос с промежуточными порциями вывода"""
+        deadline = time.monotonic() + timeout
+        try:
+            self.conn.send(message)
+            while True:
+                if not self.conn.poll(max(0.0, deadline - time.monotonic())):
+                    raise WorkerCrashed("timeout")
+                reply = self.conn.recv()
+                if "chunk" not in reply:
+                    return reply
+                on_chunk(reply["chunk"])
+        except (EOFError, OSError) as e:
+            raise WorkerCrashed(str(e))
+
+    def interrupt(self):
+        """Прерывание текущего выполнения в воркере"""
+        try:
+            os.kill(self.process.pid, signal.SIGINT)
+        except (ProcessLookupError, TypeError):
+            pass
+
+    def terminate(self):
+        """Остановка процесса"""
+        self.process.kill()
+        self.process.join(timeout=1)
+        self.conn.close()
+
+
+class SandboxExecutor:
+    """Пул песочниц с закреплением сессий за воркерами
+
+    Состояние `PythonConsole` каждого пользователя хранится внутри одного
+    долгоживущего процесса. Если процесс падает или зависает, он
+    перезапускается, а его пользователи переносятся на наименее загруженные
+    воркеры и восстанавливаются из последнего снимка.
+
+    Лимит памяти (max_memory_mb) действует на процесс целиком, то есть
+    делится между всеми пользователями воркера. Поэтому в воркере живут
+    только `max_worker_sessions` недавних консолей, остальные поднимаются
+    из снимков по требованию. Снимки приходят дельтами, полный снимок
+    каждой сессии собирается в родительском процессе; там хранятся не
+    больше `max_sessions` давно не использованных сессий.
+    """
+
+    def __init__(self, workers: int = config.EXECUTOR_WORKERS,
+                 snapshot_every: int = config.SNAPSHOT_EVERY,
+                 grace_seconds: float = config.EXECUTOR_GRACE_SECONDS,
+                 on_result=None, scheduler=None,
+                 max_worker_sessions: int = config.WORKER_MAX_SESSIONS,
+                 max_sessions: int = config.MAX_SESSIONS):
+        self.size = max(1, workers)
+        self.snapshot_every = snapshot_every
+        self.grace_seconds = grace_seconds
+        self.max_worker_sessions = max(1, max_worker_sessions)
+        self.max_sessions = max(1, max_sessions)
+        self._recent = OrderedDict()  # user_id -> None, от давно не использованных сессий к недавним
+        self._context = multiprocessing.get_context("spawn")
+        self._workers = []
+        self._assignments = {}  # user_id -> индекс воркера
+        self._snapshots = {}  # user_id -> последний снимок сессии (собирается из дельт)
+        self._streaming = {}  # user_id -> воркер, выполняющий /run
+        self._bound_names = {}  # user_id -> имена, связанные кодом пользователя
+        self.pure_cache = PureResultCache(config.PURE_CACHE_SIZE, config.PURE_CACHE_MAX_CHARS)
+        self.on_result = on_result  # on_result(user_id, тип ошибки или None) после выполнения
+        self.scheduler = scheduler  # PriorityScheduler со слотами по воркерам (None – без очереди)
+
+    @property
+    def max_execution_time(self) -> int:
+        """Текущий таймаут выполнения (из общего объекта limits)"""
+        return limits.max_execution_time
+
+    def start(self):
+        """Запуск процессов-исполнителей"""
+        self._workers = [_Worker(self._context, self.snapshot_every, self.max_worker_sessions) for _ in range(self.size)]
+
+    def shutdown(self):
+        """Остановка всех процессов"""
+        for worker in self._workers:
+            worker.terminate()
+        self._workers = []
+
+    def has_session(self, user_id: int) -> bool:
+        """Открыта ли у пользователя консоль (в том числе сохраненная до перезапуска)"""
+        return user_id in self._assignments or user_id in self._snapshots
+
+    @property
+    def workers_alive(self) -> int:
+        """Число живых процессов-исполнителей"""
+        return sum(1 for worker in self._workers if worker.process.is_alive())
+
+    @property
+    def busy_workers(self) -> int:
+        """Число воркеров, выполняющих команду прямо сейчас"""
+        return sum(1 for worker in self._workers if worker.lock.locked())
+
+    async def checkpoint(self) -> int:
+        """Свежие снимки сессий со всех свободных воркеров; число сессий
+
+        Занятые воркеры пропускаются: для их пользователей остаются
+        последние периодические снимки.
+        """
+        loop = asyncio.get_running_loop()
+        saved = 0
+        for index, worker in enumerate(self._workers):
+            if worker.lock.locked():
+                continue
+            async with worker.lock:
+                try:
+                    reply = await loop.run_in_executor(
+                        None, worker.call, ("checkpoint", None, None), self.grace_seconds
+                    )
+                except WorkerCrashed as e:
+                    logging.warning("Воркер %s не отдал снимки: %s", index, e)
+                    continue
+            if isinstance(reply["result"], dict):
+                for user_id, delta in reply["result"].items():
+                    # Консоли забытых сессий доживают в воркере до вытеснения
+                    if user_id in self._assignments:
+                        self._merge_snapshot(user_id, delta)
+                saved += len(reply["result"])
+        return saved
+
+    def save_sessions(self, path: str):
+        """Запись снимков сессий на диск (атомарная замена файла)"""
+        try:
+            directory = os.path.dirname(path)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{path}.tmp"
+            with open(tmp_path, 'wb') as f:
+                pickle.dump({"snapshots": self._snapshots, "bound_names": self._bound_names}, f)
+            os.replace(tmp_path, path)
+        except OSError as e:
+            logging.warning("Не удалось сохранить сессии: %s", e)
+
+    def load_sessions(self, path: str):
+        """Загрузка снимков сессий, сохраненных перед прошлой остановкой
+
+        Вместе со снимками восстанавливаются связанные имена: иначе
+        переменная `sum` из прошлой сессии сочлась бы чистым выражением.
+        """
+        try:
+            with open(path, 'rb') as f:
+                saved = pickle.load(f)
+        except FileNotFoundError:
+            return
+        except (OSError, pickle.UnpicklingError, EOFError) as e:
+            logging.warning("Не удалось загрузить сессии: %s", e)
+            return
+        if not isinstance(saved, dict):
+            return
+        if "snapshots" in saved:
+            snapshots, bound = saved["snapshots"], saved.get("bound_names", {})
+        else:
+            # Файл без связанных имен (сохранен до их учета)
+            snapshots, bound = saved, {}
+        for user_id, names in bound.items():
+            self._bound_names.setdefault(user_id, set()).update(names)
+        for user_id, state in snapshots.items():
+            if isinstance(state, bytes):
+                # Формат, сохраненный до перехода на дельты
+                state = pickle.loads(state)
+            self._snapshots[user_id] = state
+            self._touch(user_id)
+            # Имена восстановленных переменных связаны в сессии в любом случае
+            if state["variables"]:
+                self._bound_names.setdefault(user_id, set()).update(state["variables"])
+
+    def _assign(self, user_id: int) -> int:
+        """Закрепление пользователя за наименее загруженным воркером"""
+        index = self._assignments.get(user_id)
+        if index is None:
+            # Считаются закрепленные сессии, а не живые консоли: часть из них вытеснена
+            load = [0] * self.size
+            for assigned in self._assignments.values():
+                load[assigned] += 1
+            index = min(range(self.size), key=load.__getitem__)
+            self._assignments[user_id] = index
+        return index
+
+    async def _call(self, user_id: int, op: str, payload=None, timeout: float = None, on_chunk=None) -> dict:
+        """Отправка команды воркеру, за которым закреплен пользователь"""
+        loop = asyncio.get_running_loop()
+        limits.refresh()
+        timeout = (timeout or self.max_execution_time) + self.grace_seconds
+
+        self._touch(user_id)
+        while True:
+            # Сначала выбирается воркер, потом запрашивается слот именно на нем
+            index = self._assign(user_id)
+            async with self._slot(user_id, index):
+                # Пока ждали слот, пользователя могли перенести на другой воркер
+                if self._assignments.get(user_id) != index:
+                    continue
+                reply = await self._call_worker(loop, index, user_id, op, payload, timeout, on_chunk)
+                if reply is None:
+                    continue
+                break
+
+        if reply.get("snapshot") is not None and user_id in self._assignments:
+            self._merge_snapshot(user_id, reply["snapshot"])
+        return reply
+
+    def _touch(self, user_id):
+        """Отметка использования сессии; самые давние сессии сверх max_sessions забываются"""
+        self._recent[user_id] = None
+        self._recent.move_to_end(user_id)
+        while len(self._recent) > self.max_sessions:
+            old_id, _ = self._recent.popitem(last=False)
+            self._forget(old_id)
+
+    def _forget(self, user_id):
+        """Удаление сессии из родителя; консоль в воркере вытеснится сама"""
+        index = self._assignments.pop(user_id, None)
+        if index is not None and index < len(self._workers):
+            self._workers[index].users.discard(user_id)
+        self._snapshots.pop(user_id, None)
+        self._bound_names.pop(user_id, None)
+
+    def _accept_evicted(self, worker, reply: dict):
+        """Последние дельты консолей, вытесненных воркером: сессия поднимется из снимка"""
+        for user_id, delta in reply.get("evicted", {}).items():
+            worker.users.discard(user_id)
+            if user_id in self._assignments:
+                self._merge_snapshot(user_id, delta)
+
+    def _slot(self, user_id, index: int):
+        """Слот воркера в планировщике; класс берется из обрабатываемого обновления
+
+        Для сессий вида (бот, user_id) вес и квота бота применяются здесь,
+        в момент занятия воркера.
+        """
+        if self.scheduler is None:
+            return nullcontext()
+        # Любое обращение к воркеру занимает его, даже из UI-команды (/reset)
+        priority = max(current_priority.get(), Priority.SHORT)
+        tenant, user = user_id if isinstance(user_id, tuple) else (None, user_id)
+        return self.scheduler.slot(priority, user, tenant=tenant, worker=index)
+
+    async def _call_worker(self, loop, index: int, user_id, op: str, payload, timeout: float, on_chunk):
+        """Команда воркеру под его блокировкой; None – воркер сменился, повторить"""
+        worker = self._workers[index]
+        async with worker.lock:
+            # Пока ждали блокировку, воркер мог быть перезапущен
+            if self._workers[index] is not worker or self._assignments.get(user_id) != index:
+                return None
+
+            # После переноса сессия поднимается из снимка перед первой командой
+            if user_id not in worker.users and op != "reset":
+                message = ("restore", user_id, self._snapshots.get(user_id))
+            else:
+                message = None
+            worker.users.add(user_id)
+            try:
+                if message is not None:
+                    self._accept_evicted(worker, await loop.run_in_executor(None, worker.call, message, timeout))
+                if on_chunk is None:
+                    reply = await loop.run_in_executor(None, worker.call, (op, user_id, payload), timeout)
+                else:
+                    # Порции вывода передаются в цикл событий из потока пула
+                    def forward(text):
+                        loop.call_soon_threadsafe(on_chunk, text)
+
+                    self._streaming[user_id] = worker
+                    try:
+                        reply = await loop.run_in_executor(
+                            None, worker.call_streaming, (op, user_id, payload), timeout, forward
+                        )
+                    finally:
+                        self._streaming.pop(user_id, None)
+            except WorkerCrashed as e:
+                logging.warning("Воркер %s перезапускается: %s", index, e)
+                self._recycle(index)
+                raise
+        self._accept_evicted(worker, reply)
+        return reply
+
+    def _merge_snapshot(self, user_id, delta: dict):
+        """Применение дельты от воркера к хранимому полному снимку сессии"""
+        state = self._snapshots.get(user_id)
+        if not isinstance(state, dict):
+            state = self._snapshots[user_id] = {"variables": {}, "execution_count": 0, "notebook": []}
+        state["variables"].update(delta["variables"])
+        for name in delta["removed"]:
+            state["variables"].pop(name, None)
+        state["execution_count"] = delta["execution_count"]
+        if delta["notebook"] is not None:
+            state["notebook"] = delta["notebook"]
+
+    def _recycle(self, index: int):
+        """Перезапуск воркера и перенос его пользователей"""
+        old_worker = self._workers[index]
+        old_worker.terminate()
+        metrics.increment("worker_recycles")
+        self._workers[index] = _Worker(self._context, self.snapshot_every, self.max_worker_sessions)
+
+        for user_id in old_worker.users:
+            del self._assignments[user_id]
+            self._assign(user_id)
+
+    def _track_bindings(self, user_id: int, code: str):
+        """Учет имен, которые код мог переопределить в сессии"""
+        names = bound_names(code)
+        if names:
+            self._bound_names.setdefault(user_id, set()).update(names)
+
+    def _report(self, user_id: int, result: str, error_type: str = None):
+        """Передача исхода выполнения подписчику (аналитика класса)"""
+        if self.on_result is None:
+            return
+        if error_type is None and result.startswith(('❌', '⏰', '💥', '⛔')):
+            error_type = "Unknown"
+        self.on_result(user_id, error_type)
+
+    @staticmethod
+    def _record_timing(started: float, result: str):
+        """Учет времени песочницы; время таймаутов считается потраченным впустую"""
+        elapsed = time.monotonic() - started
+        metrics.increment("executions")
+        metrics.increment("worker_seconds", elapsed)
+        if result.startswith('⏰'):
+            metrics.increment("timeouts")
+            metrics.increment("wasted_worker_seconds", elapsed)
+
+    async def execute(self, user_id: int, code: str) -> str:
+        """Выполнение кода в сессии пользователя
+
+        Чистые выражения обслуживаются из общего кэша без обращения к песочнице.
+        """
+        # Текущие лимиты применяются до кэша: он не должен обходить их изменение
+        limits.refresh()
+        if len(code) > limits.max_code_length:
+            result = f"❌ Код слишком длинный (максимум {limits.max_code_length} символов)"
+            self._report(user_id, result, "CodeTooLong")
+            return result
+        self.pure_cache.sync(limits.version)
+
+        pure = is_pure_expression(code, self._bound_names.get(user_id, ()))
+        if pure:
+            cached = self.pure_cache.get(code)
+            if cached is not None:
+                metrics.increment("pure_cache_hits")
+                self._report(user_id, cached)
+                return cached
+        else:
+            self._track_bindings(user_id, code)
+
+        started = time.monotonic()
+        try:
+            reply = await self._call(user_id, "execute", (code, pure))
+            result, error_type = reply["result"], reply.get("error_type")
+        except WorkerCrashed:
+            reply = {}
+            result = (f"⏰ Время выполнения истекло ({self.max_execution_time} секунд). "
+                      "Песочница перезапущена, переменные восстановлены из последнего снимка")
+            error_type = "Timeout"
+        self._record_timing(started, result)
+        self._report(user_id, result, error_type)
+
+        if pure and reply.get("cacheable") and not result.startswith(('❌', '⏰', '💥')):
+            self.pure_cache.put(code, result)
+        return result
+
+    async def run(self, user_id: int, code: str, time_limit: int, output_limit: int, on_output) -> str:
+        """Длительное выполнение с потоковой передачей вывода в on_output"""
+        self._track_bindings(user_id, code)
+        started = time.monotonic()
+        try:
+            reply = await self._call(
+                user_id, "run", (code, time_limit, output_limit), timeout=time_limit, on_chunk=on_output
+            )
+            result, error_type = reply["result"], reply.get("error_type")
+        except WorkerCrashed:
+            result = (f"⏰ Время выполнения истекло ({time_limit} секунд). "
+                      "Песочница перезапущена, переменные восстановлены из последнего снимка")
+            error_type = "Timeout"
+        self._record_timing(started, result)
+        self._report(user_id, result, error_type)
+        return result
+
+    async def trace(self, user_id: int, code: str) -> dict:
+        """Пошаговая трассировка кода в сессии пользователя"""
+        self._track_bindings(user_id, code)
+        started = time.monotonic()
+        try:
+            trace = (await self._call(user_id, "trace", code))["result"]
+        except WorkerCrashed:
+            trace = {
+                "result": (f"⏰ Время выполнения истекло ({self.max_execution_time} секунд). "
+                           "Песочница перезапущена, переменные восстановлены из последнего снимка"),
+                "steps": [], "output": "", "truncated": False
+            }
+        self._record_timing(started, trace["result"])
+        return trace
+
+    async def notebook(self, user_id: int, action: str, *args) -> list:
+        """Команда блокнота (add, edit, listing); [(номер, код, результат)]"""
+        for code in args[-1:]:
+            if isinstance(code, str):
+                self._track_bindings(user_id, code)
+        started = time.monotonic()
+        try:
+            # Правка может перезапустить все ячейки блокнота
+            cells = (await self._call(
+                user_id, "notebook", (action, args),
+                timeout=self.max_execution_time * config.NOTEBOOK_MAX_CELLS
+            ))["result"]
+        except WorkerCrashed:
+            return [(None, "", "⏰ Время выполнения истекло. Песочница перезапущена")]
+        if action != "listing":
+            timed_out = any((result or "").startswith('⏰') for _, _, result in cells)
+            self._record_timing(started, '⏰' if timed_out else '')
+        return cells
+
+    def is_running(self, user_id: int) -> bool:
+        """Идет ли у пользователя выполнение /run"""
+        return user_id in self._streaming
+
+    def cancel(self, user_id: int) -> bool:
+        """Остановка выполнения /run пользователя"""
+        worker = self._streaming.get(user_id)
+        if worker is None:
+            return False
+        worker.interrupt()
+        return True
+
+    async def reset(self, user_id: int) -> str:
+        """Новая (или очищенная) консоль пользователя"""
+        self._snapshots.pop(user_id, None)
+        self._bound_names.pop(user_id, None)
+        try:
+            reply = await self._call(user_id, "reset")
+        except WorkerCrashed:
+            return "💥 Песочница перезапущена, консоль очищена"
+        return reply["result"]
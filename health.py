@@ -0,0 +1,138 @@
+import asyncio
+import json
+import logging
+import time
+
+# Ограничение на размер тела webhook-запроса
+_MAX_BODY_SIZE = 1024 * 1024
+
+
+class LoopLagMonitor:
+    """Измерение задержки цикла событий
+
+    Задача просыпается каждые `interval` секунд; опоздание пробуждения и есть
+    задержка: столько ждал бы любой обработчик, готовый к выполнению.
+    """
+
+    def __init__(self, interval: float = 0.5):
+        self.interval = interval
+        self.lag = 0.0  # Последнее измерение, секунды
+        self.max_lag = 0.0  # Максимум с момента запуска
+        self._task = None
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+    async def _run(self):
+        loop = asyncio.get_running_loop()
+        while True:
+            expected = loop.time() + self.interval
+            await asyncio.sleep(self.interval)
+            self.lag = max(0.0, loop.time() - expected)
+            self.max_lag = max(self.max_lag, self.lag)
+
+
+class HealthServer:
+    """Минимальный HTTP-сервер для /healthz, /readyz и webhook ботов
+
+    `report()` возвращает (готов ли бот, {проверка: значение}). /healthz
+    отвечает 200, пока цикл событий жив; /readyz – 200 или 503 по `report()`.
+    Сервер отвечает из того же цикла событий, что и бот, поэтому сам факт
+    ответа подтверждает, что цикл не завис.
+
+    `webhooks` – {путь: async handler(тело запроса) -> HTTP-статус} для POST
+    от Telegram; так несколько ботов делят один порт.
+    """
+
+    def __init__(self, report, host: str = "0.0.0.0", port: int = 8081, webhooks: dict = None):
+        self.report = report
+        self.host = host
+        self.port = port
+        self.webhooks = webhooks if webhooks is not None else {}
+        self._server = None
+
+    async def start(self):
+        self._server = await asyncio.start_server(self._handle, self.host, self.port)
+        logging.info("HTTP-сервер: http://%s:%s (/healthz, /readyz, webhook ботов)", self.host, self.port)
+
+    async def stop(self):
+        if self._server is not None:
+            self._server.close()
+            await self._server.wait_closed()
+            self._server = None
+
+    async def _handle(self, reader, writer):
+        try:
+            request_line = await asyncio.wait_for(reader.readline(), timeout=5)
+            content_length = 0
+            while True:
+                header = await asyncio.wait_for(reader.readline(), timeout=5)
+                if header in (b"\r\n", b"\n", b""):
+                    break
+                name, _, value = header.decode("latin-1").partition(":")
+                if name.strip().lower() == "content-length":
+                    content_length = int(value.strip() or 0)
+            parts = request_line.decode("latin-1").split()
+            method = parts[0] if parts else ""
+            path = parts[1].split("?", 1)[0] if len(parts) > 1 else ""
+
+            if method == "POST" and path in self.webhooks:
+                if content_length > _MAX_BODY_SIZE:
+                    status = 413
+                else:
+                    body = await asyncio.wait_for(reader.readexactly(content_length), timeout=10)
+                    status = await self.webhooks[path](body)
+                body = {}
+            elif path == "/healthz":
+                _, checks = self.report()
+                status, body = 200, {"status": "ok", "checks": checks}
+            elif path == "/readyz":
+                ready, checks = self.report()
+                status = 200 if ready else 503
+                body = {"status": "ready" if ready else "not_ready", "checks": checks}
+            else:
+                status, body = 404, {"status": "not_found"}
+            await self._respond(writer, status, body)
+        except (asyncio.TimeoutError, asyncio.IncompleteReadError, ConnectionError):
+            pass
+        except Exception as e:
+            logging.warning("Ошибка проверки состояния: %s", e)
+            await self._respond(writer, 500, {"status": "error"})
+        finally:
+            writer.close()
+
+    @staticmethod
+    async def _respond(writer, status: int, body: dict):
+        reasons = {
+            200: "OK", 400: "Bad Request", 404: "Not Found", 413: "Payload Too Large",
+            500: "Internal Server Error", 503: "Service Unavailable",
+        }
+        payload = json.dumps(body, ensure_ascii=False).encode()
+        writer.write(
+            f"HTTP/1.1 {status} {reasons[status]}\r\n"
+            "Content-Type: application/json; charset=utf-8\r\n"
+            f"Content-Length: {len(payload)}\r\n"
+            "Connection: close\r\n\r\n".encode() + payload
+        )
+        try:
+            await writer.drain()
+        except ConnectionError:
+            pass
+
+
+async def wait_until(condition, deadline: float, interval: float = 0.1) -> bool:
+    """Ожидание condition() до момента deadline (time.monotonic); True – дождались"""
+    while not condition():
+        if time.monotonic() >= deadline:
+            return False
+        await asyncio.sleep(interval)
+    return True
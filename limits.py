@@ -0,0 +1,117 @@
+import json
+import logging
+import os
+
+import config
+
+# Настраиваемые ограничения: имя -> (значение по умолчанию, минимум, максимум)
+_LIMITS = {
+    "max_code_length": (config.MAX_CODE_LENGTH, 10, 100_000),
+    "max_output_length": (config.MAX_OUTPUT_LENGTH, 100, 100_000),
+    "max_execution_time": (config.MAX_EXECUTION_TIME, 1, 60),
+    "max_memory_mb": (config.MAX_MEMORY_MB, 16, 1024),
+    "long_execution_time": (config.LONG_EXECUTION_TIME, 1, 3600),
+    "long_output_length": (config.LONG_OUTPUT_LENGTH, 100, 1_000_000),
+}
+
+
+class Limits:
+    """Ограничения выполнения, общие для всех модулей и процессов
+
+    Значения по умолчанию берутся из config.py, переопределения хранятся
+    в файле `path` (JSON). `refresh()` перечитывает файл, только если изменилось
+    время его модификации, и вызывается перед каждым выполнением: изменения
+    командой /limits или правкой файла вступают в силу со следующего запуска
+    во всех процессах-исполнителях без перезапуска бота.
+    """
+
+    def __init__(self, path: str = None):
+        self.path = path
+        self.version = 0  # Растет при каждом изменении значений
+        self._mtime = None
+        self._apply({})
+        self.refresh()
+
+    def _apply(self, overrides: dict):
+        for name, (default, _, _) in _LIMITS.items():
+            setattr(self, name, overrides.get(name, default))
+        self.version += 1
+
+    def as_dict(self) -> dict:
+        """Текущие значения всех ограничений"""
+        return {name: getattr(self, name) for name in _LIMITS}
+
+    @staticmethod
+    def validate(changes: dict) -> dict:
+        """Проверка имен и диапазонов; ValueError при ошибке"""
+        validated = {}
+        for name, value in changes.items():
+            if name not in _LIMITS:
+                raise ValueError(f"неизвестное ограничение: {name}")
+            _, low, high = _LIMITS[name]
+            try:
+                value = int(value)
+            except (TypeError, ValueError):
+                raise ValueError(f"{name}: нужно целое число")
+            if not low <= value <= high:
+                raise ValueError(f"{name}: допустимо от {low} до {high}")
+            validated[name] = value
+        return validated
+
+    def refresh(self) -> bool:
+        """Перечитывание файла при изменении; True – значения поменялись"""
+        if not self.path:
+            return False
+        try:
+            mtime = os.stat(self.path).st_mtime_ns
+        except FileNotFoundError:
+            mtime = None
+        except OSError as e:
+            logging.warning("Не удалось проверить файл ограничений: %s", e)
+            return False
+        if mtime == self._mtime:
+            return False
+        self._mtime = mtime
+
+        overrides = {}
+        if mtime is not None:
+            try:
+                with open(self.path, encoding='utf-8') as f:
+                    overrides = self.validate(json.load(f))
+            except (OSError, ValueError, AttributeError) as e:
+                # Ошибочный файл не сбрасывает действующие значения
+                logging.warning("Файл ограничений не применен: %s", e)
+                return False
+        previous = self.as_dict()
+        self._apply(overrides)
+        return self.as_dict() != previous
+
+    def update(self, **changes) -> dict:
+        """Изменение ограничений с записью в файл; ValueError при ошибке"""
+        values = self.as_dict()
+        values.update(self.validate(changes))
+        overrides = {name: value for name, value in values.items() if value != _LIMITS[name][0]}
+        self._write(overrides)
+        return self.as_dict()
+
+    def reset(self) -> dict:
+        """Возврат к значениям из config.py"""
+        self._write({})
+        return self.as_dict()
+
+    def _write(self, overrides: dict):
+        if not self.path:
+            self._apply(overrides)
+            return
+        directory = os.path.dirname(self.path)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            json.dump(overrides, f, indent=2)
+        os.replace(tmp_path, self.path)
+        self.refresh()
+
+
+# Единый экземпляр на процесс; процессы-исполнители читают тот же файл
+limits = Limits(config.LIMITS_FILE)
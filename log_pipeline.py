@@ -0,0 +1,144 @@
+import atexit
+import hashlib
+import json
+import logging
+import logging.handlers
+import os
+import queue
+import sys
+import time
+
+import config
+from metrics import metrics
+
+# Логгер структурированных событий (JSON lines)
+EVENTS_LOGGER = "tgbb.events"
+
+_queue = None
+_listener = None
+_sample_counter = 0
+
+
+class _DroppingQueueHandler(logging.handlers.QueueHandler):
+    """QueueHandler, который никогда не блокирует: при переполнении запись отбрасывается"""
+
+    def enqueue(self, record):
+        try:
+            self.queue.put_nowait(record)
+        except queue.Full:
+            metrics.increment("log_records_dropped")
+
+
+class _JsonLinesFormatter(logging.Formatter):
+    """Событие записи – одна строка JSON"""
+
+    def format(self, record) -> str:
+        event = dict(getattr(record, "event", {}))
+        event.setdefault("ts", round(record.created, 3))
+        event.setdefault("event", record.getMessage())
+        return json.dumps(event, ensure_ascii=False)
+
+
+class _EventFilter(logging.Filter):
+    """Пропускает только структурированные события (или только обычные записи)"""
+
+    def __init__(self, events: bool):
+        super().__init__()
+        self.events = events
+
+    def filter(self, record) -> bool:
+        return hasattr(record, "event") == self.events
+
+
+def setup_logging(level: str = config.LOG_LEVEL):
+    """Настройка логирования: запись в очередь, вывод – в фоновом потоке
+
+    Обычные записи уходят в stderr, события выполнения – в файл JSON lines
+    с ротацией по размеру. Обработчик цикла событий только кладет запись
+    в ограниченную очередь и никогда не ждет ввода-вывода.
+    """
+    global _queue, _listener
+    if _listener is not None:
+        return _listener
+
+    _queue = queue.Queue(maxsize=config.LOG_QUEUE_SIZE)
+
+    console_handler = logging.StreamHandler(sys.stderr)
+    console_handler.setFormatter(logging.Formatter('%(asctime)s - %(name)s - %(levelname)s - %(message)s'))
+    console_handler.addFilter(_EventFilter(events=False))
+    handlers = [console_handler]
+
+    try:
+        directory = os.path.dirname(config.EVENT_LOG_FILE)
+        if directory:
+            os.makedirs(directory, exist_ok=True)
+        events_handler = logging.handlers.RotatingFileHandler(
+            config.EVENT_LOG_FILE,
+            maxBytes=config.EVENT_LOG_MAX_BYTES,
+            backupCount=config.EVENT_LOG_BACKUPS,
+            encoding='utf-8'
+        )
+        events_handler.setFormatter(_JsonLinesFormatter())
+        events_handler.addFilter(_EventFilter(events=True))
+        handlers.append(events_handler)
+    except OSError as e:
+        print(f"⚠️ Не удалось открыть журнал событий: {e}", file=sys.stderr)
+
+    root = logging.getLogger()
+    root.handlers = [_DroppingQueueHandler(_queue)]
+    root.setLevel(level)
+
+    _listener = logging.handlers.QueueListener(_queue, *handlers, respect_handler_level=True)
+    _listener.start()
+    atexit.register(stop_logging)
+    return _listener
+
+
+def stop_logging():
+    """Остановка фонового потока с дозаписью очереди"""
+    global _listener
+    if _listener is not None:
+        _listener.stop()
+        _listener = None
+
+
+def user_hash(user_id: int) -> str:
+    """Псевдоним пользователя для журналов"""
+    return hashlib.sha256(f"{config.LOG_SALT}:{user_id}".encode()).hexdigest()[:16]
+
+
+def _sampled_out(outcome: str) -> bool:
+    """Под нагрузкой успешные события записываются выборочно (1 из LOG_SAMPLE_RATE)"""
+    global _sample_counter
+    if outcome != "ok" or _queue is None or _queue.qsize() < config.LOG_SAMPLE_THRESHOLD:
+        return False
+    _sample_counter += 1
+    return _sample_counter % config.LOG_SAMPLE_RATE != 0
+
+
+def outcome_of(result: str) -> str:
+    """Исход выполнения по префиксу ответа песочницы"""
+    for prefix, outcome in (('❌', "error"), ('⏰', "timeout"), ('💥', "memory"), ('⛔', "cancelled")):
+        if result.startswith(prefix):
+            return outcome
+    return "ok"
+
+
+def log_execution(kind: str, user_id: int, outcome: str, duration: float,
+                  code_size: int, output_size: int, **fields):
+    """Событие выполнения кода (выполнение, /run, /trace, блокнот)"""
+    if _sampled_out(outcome):
+        metrics.increment("log_events_sampled_out")
+        return
+    event = {
+        "event": "execution",
+        "kind": kind,
+        "user": user_hash(user_id),
+        "outcome": outcome,
+        "duration_ms": round(duration * 1000, 1),
+        "code_size": code_size,
+        "output_size": output_size,
+        "ts": round(time.time(), 3),
+    }
+    event.update(fields)
+    logging.getLogger(EVENTS_LOGGER).info("execution", extra={"event": event})
@@ -0,0 +1,32 @@
+import threading
+import time
+from collections import defaultdict
+
+
+class Metrics:
+    """Счетчики работы бота (общие для всех модулей процесса)"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._counters = defaultdict(float)
+        self.started_at = time.time()
+
+    def increment(self, name: str, value: float = 1, label: str = None):
+        """Увеличение счетчика; label – необязательное уточнение (например, причина)"""
+        key = f"{name}.{label}" if label else name
+        with self._lock:
+            self._counters[key] += value
+
+    def get(self, name: str) -> float:
+        """Текущее значение счетчика"""
+        with self._lock:
+            return self._counters.get(name, 0)
+
+    def snapshot(self) -> dict:
+        """Копия всех счетчиков"""
+        with self._lock:
+            return dict(self._counters)
+
+
+# Единый экземпляр на процесс
+metrics = Metrics()
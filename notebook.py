@@ -0,0 +1,137 @@
+import ast
+
+from pure_cache import DYNAMIC_NAMESPACE, bound_names
+
+
+def analyze_cell(code: str) -> tuple:
+    """Имена, которые ячейка читает и записывает (по AST)
+
+    Вызов метода у переменной (lst.append(...)) считается и чтением,
+    и записью: объект мог измениться на месте.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return set(), set()
+
+    reads = set()
+    writes = bound_names(code)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and isinstance(node.ctx, ast.Load):
+            reads.add(node.id)
+        elif isinstance(node, ast.Call) and isinstance(node.func, ast.Attribute):
+            root = node.func.value
+            while isinstance(root, (ast.Attribute, ast.Subscript)):
+                root = root.value
+            if isinstance(root, ast.Name):
+                writes.add(root.id)
+    return reads, writes
+
+
+class Cell:
+    """Ячейка блокнота"""
+
+    def __init__(self, code: str):
+        self.code = code
+        self.reads, self.writes = analyze_cell(code)
+        self.result = None
+
+
+class Notebook:
+    """Блокнот: пронумерованные ячейки с перезапуском только зависимых
+
+    При правке ячейки выполняется она сама и те ячейки ниже, которые читают
+    имена, измененные уже перезапущенными ячейками. Стоимость правки зависит
+    от размера затронутого подграфа, а не от всей программы.
+    """
+
+    def __init__(self, run, max_cells: int = 20):
+        self.run = run  # run(code) -> str, выполнение в пространстве имен сессии
+        self.max_cells = max_cells
+        self.cells = []
+
+    def add(self, code: str) -> list:
+        """Новая ячейка в конце; [(номер, код, результат)]"""
+        if len(self.cells) >= self.max_cells:
+            return [(None, code, f"❌ В блокноте не больше {self.max_cells} ячеек")]
+        cell = Cell(code)
+        self.cells.append(cell)
+        cell.result = self.run(code)
+        return [(len(self.cells), cell.code, cell.result)]
+
+    def edit(self, number: int, code: str) -> list:
+        """Замена ячейки number (с 1) и перезапуск затронутых; [(номер, код, результат)]"""
+        index = number - 1
+        if not 0 <= index < len(self.cells):
+            return [(None, code, f"❌ Ячейки {number} нет")]
+
+        old = self.cells[index]
+        new = self.cells[index] = Cell(code)
+        start = {index}
+
+        # Имена, которые ячейка больше не записывает, должны вернуться
+        # к значениям из ячеек выше
+        for name in old.writes - new.writes:
+            upstream = self._last_writer(name, index)
+            if upstream is not None:
+                start.add(upstream)
+
+        return [
+            (position + 1, self.cells[position].code, self._rerun(position))
+            for position in self._plan(start, old.writes | new.writes)
+        ]
+
+    def _plan(self, start: set, dirty: set) -> list:
+        """Ячейки к перезапуску: стартовые и все ниже, читающие измененные имена
+
+        Ячейка, которая читает и записывает одно имя (x += 1, lst.append(...)),
+        при повторном запуске должна получить свежее значение, поэтому
+        ближайшая ячейка выше, записывающая это имя, тоже перезапускается.
+        """
+        rerun = set(start)
+        while True:
+            changed = set(dirty)
+            for position in range(min(rerun), len(self.cells)):
+                cell = self.cells[position]
+                if position in rerun or DYNAMIC_NAMESPACE in changed or cell.reads & changed:
+                    rerun.add(position)
+                    changed |= cell.writes
+
+            producers = set()
+            for position in rerun:
+                cell = self.cells[position]
+                for name in cell.reads & cell.writes:
+                    producer = self._last_writer(name, position)
+                    if producer is not None and producer not in rerun:
+                        producers.add(producer)
+            if not producers:
+                return sorted(rerun)
+            rerun |= producers
+
+    def _last_writer(self, name: str, before: int):
+        """Ближайшая ячейка выше before, записывающая name"""
+        for position in range(before - 1, -1, -1):
+            if name in self.cells[position].writes:
+                return position
+        return None
+
+    def _rerun(self, position: int) -> str:
+        cell = self.cells[position]
+        cell.result = self.run(cell.code)
+        return cell.result
+
+    def listing(self) -> list:
+        """Все ячейки с последними результатами"""
+        return [(position + 1, cell.code, cell.result) for position, cell in enumerate(self.cells)]
+
+    def dump(self) -> list:
+        """Данные для снимка сессии"""
+        return [(cell.code, cell.result) for cell in self.cells]
+
+    def load(self, cells: list):
+        """Восстановление ячеек из снимка (без выполнения)"""
+        self.cells = []
+        for code, result in cells:
+            cell = Cell(code)
+            cell.result = result
+            self.cells.append(cell)
@@ -0,0 +1,205 @@
+import ast
+from collections import OrderedDict
+from types import SimpleNamespace
+
+# Функции, результат которых зависит только от аргументов
+PURE_FUNCTIONS = frozenset({
+    'abs', 'all', 'any', 'ascii', 'bin', 'bool', 'bytes', 'chr', 'complex',
+    'dict', 'divmod', 'float', 'format', 'frozenset', 'hex', 'int', 'len',
+    'list', 'max', 'min', 'oct', 'ord', 'pow', 'range', 'repr', 'round',
+    'set', 'sorted', 'str', 'sum', 'tuple', 'type'
+})
+
+# Модули песочницы без состояния (random и datetime сюда не входят)
+PURE_MODULES = frozenset({'math'})
+
+# Вызовы, через которые код может читать или менять пространство имен
+_NAMESPACE_ACCESS = frozenset({'globals', 'locals', 'vars', 'setattr', 'delattr'})
+
+# Метка сессии, в которой пространство имен менялось динамически
+DYNAMIC_NAMESPACE = '*'
+
+
+def bound_names(code: str) -> set:
+    """Имена, которые код может связать в пространстве имен сессии
+
+    Изменение атрибутов или элементов (math.sqrt = ..., x[0] = ...) считается
+    связыванием корневого имени. Если код обращается к globals()/setattr и т.п.,
+    возвращается DYNAMIC_NAMESPACE – такую сессию нельзя обслуживать из кэша.
+    """
+    try:
+        tree = ast.parse(code)
+    except SyntaxError:
+        return set()
+
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if not isinstance(node.ctx, ast.Load):
+                names.add(node.id)
+            elif node.id in _NAMESPACE_ACCESS:
+                names.add(DYNAMIC_NAMESPACE)
+        elif isinstance(node, (ast.Attribute, ast.Subscript)) and not isinstance(node.ctx, ast.Load):
+            root = node.value
+            while isinstance(root, (ast.Attribute, ast.Subscript)):
+                root = root.value
+            if isinstance(root, ast.Name):
+                names.add(root.id)
+        elif isinstance(node, (ast.FunctionDef, ast.AsyncFunctionDef, ast.ClassDef)):
+            names.add(node.name)
+        elif isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                names.add((alias.asname or alias.name).split('.', 1)[0])
+        elif isinstance(node, (ast.Global, ast.Nonlocal)):
+            names.update(node.names)
+        elif isinstance(node, (ast.MatchAs, ast.MatchStar)) and node.name:
+            # Шаблоны match связывают имена: case x, case [*rest]
+            names.add(node.name)
+        elif isinstance(node, ast.MatchMapping) and node.rest:
+            names.add(node.rest)
+    return names
+
+
+def _comprehension_names(tree) -> set:
+    """Переменные генераторов списков (локальны для выражения)"""
+    names = set()
+    for node in ast.walk(tree):
+        if isinstance(node, ast.comprehension):
+            for target in ast.walk(node.target):
+                if isinstance(target, ast.Name):
+                    names.add(target.id)
+    return names
+
+
+def is_pure_expression(code: str, session_names=()) -> bool:
+    """Является ли код чистым выражением, результат которого можно разделять между пользователями
+
+    Чистое выражение – одно выражение, которое ссылается только на
+    PURE_FUNCTIONS и PURE_MODULES, не переопределенные в сессии,
+    и ничего не присваивает.
+    """
+    if DYNAMIC_NAMESPACE in session_names:
+        return False
+    try:
+        tree = ast.parse(code.strip(), mode='eval')
+    except SyntaxError:
+        return False
+
+    for node in ast.walk(tree):
+        if isinstance(node, (ast.NamedExpr, ast.Lambda, ast.Await, ast.Yield, ast.YieldFrom)):
+            return False
+
+    # Переменные генераторов списков локальны для выражения
+    comprehension_names = _comprehension_names(tree)
+
+    if comprehension_names & set(session_names):
+        return False
+
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name):
+            if node.id in comprehension_names:
+                continue
+            if node.id in session_names:
+                return False
+            if node.id not in PURE_FUNCTIONS and node.id not in PURE_MODULES:
+                return False
+        elif isinstance(node, ast.Attribute) and node.attr.startswith('_'):
+            return False
+    return True
+
+
+_MISSING = object()
+
+
+def _lookup(namespace: dict, name: str):
+    """Значение имени так, как его найдет eval: глобальные, затем __builtins__"""
+    if name in namespace:
+        return namespace[name]
+    builtins = namespace.get('__builtins__', {})
+    if not isinstance(builtins, dict):
+        builtins = vars(builtins)
+    return builtins.get(name, _MISSING)
+
+
+def _same_object(value, original) -> bool:
+    """Тот же объект; пространства имен модулей (math) сравниваются по атрибутам"""
+    if value is original:
+        return True
+    if isinstance(value, SimpleNamespace) and isinstance(original, SimpleNamespace):
+        current, expected = vars(value), vars(original)
+        return current.keys() == expected.keys() and all(current[key] is expected[key] for key in expected)
+    return False
+
+
+def references_originals(code: str, namespace: dict, original: dict) -> bool:
+    """Все ли имена выражения в `namespace` – те же объекты, что в чистом `original`
+
+    Проверка выполняется в воркере после выполнения, прямо по пространству
+    имен сессии, поэтому не зависит от того, заметил ли разбор кода
+    в родителе все способы переопределить имя.
+    """
+    try:
+        tree = ast.parse(code.strip(), mode='eval')
+    except SyntaxError:
+        return False
+    local_names = _comprehension_names(tree)
+    for node in ast.walk(tree):
+        if isinstance(node, ast.Name) and node.id not in local_names:
+            expected = _lookup(original, node.id)
+            if expected is _MISSING or not _same_object(_lookup(namespace, node.id), expected):
+                return False
+    return True
+
+
+class PureResultCache:
+    """Общий для всех пользователей LRU-кэш результатов чистых выражений
+
+    Размер ограничен и числом записей, и суммарной длиной кода и результатов
+    (символов), чтобы длинные результаты не занимали гигабайты.
+    """
+
+    def __init__(self, maxsize: int = 2048, max_chars: int = 4 * 1024 * 1024):
+        self.maxsize = maxsize
+        self.max_chars = max_chars
+        self._results = OrderedDict()
+        self._chars = 0
+        self.hits = 0
+        self.misses = 0
+        self.version = None  # Версия лимитов, при которой получены результаты
+
+    @staticmethod
+    def _key(code: str) -> str:
+        return code.strip()
+
+    def sync(self, version):
+        """Сброс кэша при смене лимитов: результаты зависят от лимита вывода"""
+        if version != self.version:
+            self._results.clear()
+            self._chars = 0
+            self.version = version
+
+    def get(self, code: str):
+        """Готовый результат или None"""
+        key = self._key(code)
+        result = self._results.get(key)
+        if result is None:
+            self.misses += 1
+            return None
+        self._results.move_to_end(key)
+        self.hits += 1
+        return result
+
+    def put(self, code: str, result: str):
+        """Сохранение результата с вытеснением самых старых"""
+        key = self._key(code)
+        size = len(key) + len(result)
+        if size > self.max_chars:
+            return
+        previous = self._results.pop(key, None)
+        if previous is not None:
+            self._chars -= len(key) + len(previous)
+        self._results[key] = result
+        self._chars += size
+        while len(self._results) > self.maxsize or self._chars > self.max_chars:
+            old_key, old_result = self._results.popitem(last=False)
+            self._chars -= len(old_key) + len(old_result)
@@ -3,8 +3,15 @@ import io
 import signal
 import time
 import resource
-from contextlib import redirect_stdout, redirect_stderr
+import pickle
+import hashlib
+from contextlib import nullcontext, redirect_stdout, redirect_stderr
+from functools import lru_cache
+import config
+from limits import limits
+from notebook import Notebook
 from security import SecurityManager
+from tracer import TRACE_FILENAME, ExecutionTracer
 
 class TimeoutException(Exception):
     """Исключение для таймаута выполнения"""
@@ -14,73 +21,254 @@ class MemoryLimitException(Exception):
     """Исключение для превышения лимита памяти"""
     pass
 
+class ExecutionCancelled(BaseException):
+    """Выполнение остановлено пользователем
+
+    Наследуется от BaseException, чтобы не перехватываться как ошибка кода:
+    на пути от пользовательского кода до воркера допустим только
+    `except Exception`, а не голый `except:`.
+    """
+    pass
+
+@lru_cache(maxsize=config.COMPILE_CACHE_SIZE)
+def compile_code(code: str) -> tuple:
+    """(объект кода, выражение ли это); кэш общий для всех консолей процесса
+
+    Одинаковые запросы учеников (в том числе из разных ботов) компилируются один раз.
+    """
+    try:
+        return compile(code, '<string>', 'eval'), True
+    except SyntaxError:
+        return compile(code, '<string>', 'exec'), False
+
+def _address_space_size() -> int:
+    """Текущий размер адресного пространства процесса в байтах (0, если неизвестен)"""
+    try:
+        with open('/proc/self/statm') as f:
+            return int(f.read().split()[0]) * resource.getpagesize()
+    except (OSError, ValueError, IndexError):
+        return 0
+
+# Адресное пространство процесса до выполнения пользовательского кода
+# (интерпретатор и модули); фиксируется при первой установке лимита
+_baseline_memory = None
+
+def set_memory_limit(max_memory_mb: int):
+    """Лимит памяти процесса: базовый размер интерпретатора + max_memory_mb
+
+    RLIMIT_AS действует на весь процесс, поэтому max_memory_mb – общий запас
+    для всех консолей, закрепленных за процессом-исполнителем, а не лимит
+    одного пользователя. Меняется только мягкий лимит, чтобы его можно было
+    и поднять при изменении ограничений.
+    """
+    global _baseline_memory
+    if _baseline_memory is None:
+        _baseline_memory = _address_space_size()
+    try:
+        # Конвертируем MB в bytes
+        memory_limit = _baseline_memory + max_memory_mb * 1024 * 1024
+        _, hard_limit = resource.getrlimit(resource.RLIMIT_AS)
+        if hard_limit != resource.RLIM_INFINITY:
+            memory_limit = min(memory_limit, hard_limit)
+        resource.setrlimit(resource.RLIMIT_AS, (memory_limit, hard_limit))
+    except (ValueError, resource.error) as e:
+        # На некоторых системах могут быть ограничения
+        print(f"⚠️ Не удалось установить лимит памяти: {e}")
+
 class PythonConsole:
     def __init__(self):
         self.security = SecurityManager()
         self.local_vars = self.security.create_safe_globals()
-        self.max_execution_time = 5  # секунд
-        self.max_output_length = 2000
-        self.max_memory_mb = 50  # MB
+        self._baseline_names = frozenset(self.local_vars)
+        self.notebook = Notebook(self.execute, max_cells=config.NOTEBOOK_MAX_CELLS)
         self.execution_count = 0
+        self.last_error_type = None  # Тип ошибки последнего выполнения (для аналитики)
+        # Что уже передано родителю: имя -> хэш сериализованного значения, хэш блокнота
+        self._sent_variables = {}
+        self._sent_notebook = None
         
         # Устанавливаем лимит памяти
         self._set_memory_limit()
-        
+
+    # Ограничения читаются из общего объекта limits при каждом обращении
+    @property
+    def max_execution_time(self) -> int:
+        return limits.max_execution_time  # секунд
+
+    @property
+    def max_output_length(self) -> int:
+        return limits.max_output_length
+
+    @property
+    def max_memory_mb(self) -> int:
+        return limits.max_memory_mb  # MB
+
     def _set_memory_limit(self):
-        """Установка лимита памяти"""
-        try:
-            # Конвертируем MB в bytes
-            memory_limit = self.max_memory_mb * 1024 * 1024
-            resource.setrlimit(resource.RLIMIT_AS, (memory_limit, memory_limit))
-        except (ValueError, resource.error) as e:
-            # На некоторых системах могут быть ограничения
-            print(f"⚠️ Не удалось установить лимит памяти: {e}")
+        """Установка лимита памяти процесса (см. set_memory_limit)"""
+        set_memory_limit(self.max_memory_mb)
 
     def reset_console(self):
         """Сброс состояния консоли"""
         self.local_vars = self.security.create_safe_globals()
         self.execution_count = 0
+        self.notebook = Notebook(self.execute, max_cells=config.NOTEBOOK_MAX_CELLS)
+        self._sent_variables = {}
+        self._sent_notebook = None
         return "🔄 Консоль сброшена! Все переменные очищены."
 
-    def execute(self, code: str) -> str:
-        """Безопасное выполнение Python кода"""
+    def snapshot(self) -> dict:
+        """Полный снимок пользовательских переменных для переноса сессии
+
+        Каждое значение сериализуется отдельно; несериализуемые значения
+        (функции, модули и т.п.) пропускаются.
+        """
+        variables = {}
+        for name, value in self.local_vars.items():
+            if name in self._baseline_names:
+                continue
+            try:
+                variables[name] = pickle.dumps(value)
+            except Exception:
+                continue
+        return {
+            "variables": variables,
+            "execution_count": self.execution_count,
+            "notebook": self.notebook.dump()
+        }
+
+    def snapshot_delta(self) -> dict:
+        """Изменения с предыдущего снимка: по IPC уходят только новые и измененные значения
+
+        Родитель применяет дельту к своей копии снимка (merge_snapshot).
+        """
+        state = self.snapshot()
+        digests = {name: hashlib.blake2b(payload, digest_size=16).digest()
+                   for name, payload in state["variables"].items()}
+        changed = {name: payload for name, payload in state["variables"].items()
+                   if self._sent_variables.get(name) != digests[name]}
+        removed = [name for name in self._sent_variables if name not in digests]
+        self._sent_variables = digests
+
+        notebook_digest = hashlib.blake2b(pickle.dumps(state["notebook"]), digest_size=16).digest()
+        notebook = state["notebook"] if notebook_digest != self._sent_notebook else None
+        self._sent_notebook = notebook_digest
+        return {
+            "variables": changed,
+            "removed": removed,
+            "execution_count": state["execution_count"],
+            "notebook": notebook
+        }
+
+    def restore(self, state: dict):
+        """Восстановление переменных из снимка (родитель хранит его целиком)"""
+        for name, payload in state["variables"].items():
+            try:
+                self.local_vars[name] = pickle.loads(payload)
+            except Exception:
+                continue
+        self.execution_count = state["execution_count"]
+        self.notebook.load(state.get("notebook", []))
+        # Восстановленное родителю уже известно
+        self._sent_variables = {name: hashlib.blake2b(payload, digest_size=16).digest()
+                                for name, payload in state["variables"].items()}
+        self._sent_notebook = hashlib.blake2b(pickle.dumps(self.notebook.dump()), digest_size=16).digest()
+
+    def execute(self, code: str, time_limit: int = None, stdout=None) -> str:
+        """Безопасное выполнение Python кода
+
+        time_limit переопределяет таймаут, stdout – поток для вывода
+        (например, для потоковой передачи в режиме /run).
+        """
         if not code.strip():
             return "Введите код для выполнения"
         
         # Увеличиваем счетчик выполненных операций
         self.execution_count += 1
+        self.last_error_type = None
+        self._refresh_limits()
         
-        # Проверка безопасности
+        error = self._check_code(code)
+        if error:
+            return error
+
+        try:
+            return self._execute_safely(code, time_limit, stdout)
+            
+        except TimeoutException as e:
+            self.last_error_type = "Timeout"
+            return f"⏰ {str(e)}"
+        except MemoryLimitException as e:
+            self.last_error_type = "MemoryError"
+            return f"💥 {str(e)}"
+        except Exception as e:
+            self.last_error_type = type(e).__name__
+            return f"❌ Ошибка выполнения: {str(e)}"
+
+    def _refresh_limits(self):
+        """Подхват измененных ограничений перед выполнением"""
+        if limits.refresh():
+            self._set_memory_limit()
+
+    def _check_code(self, code: str):
+        """Проверки безопасности и длины; текст ошибки или None"""
         security_check = self.security.sanitize_input(code)
         if not security_check["is_safe"]:
             issues = security_check["issues"][:3]  # Показываем первые 3 ошибки
-            return "❌ **Обнаружены проблемы с безопасностью:**\n" + "\n".join(issues)
+            self.last_error_type = "SecurityViolation"
+            return "❌ Обнаружены проблемы с безопасностью:\n" + "\n".join(issues)
         
         # Проверка длины кода
-        if len(code) > 1000:
-            return "❌ Код слишком длинный (максимум 1000 символов)"
+        if len(code) > limits.max_code_length:
+            self.last_error_type = "CodeTooLong"
+            return f"❌ Код слишком длинный (максимум {limits.max_code_length} символов)"
+        return None
 
+    def trace(self, code: str, max_steps: int = 200) -> dict:
+        """Пошаговое выполнение с записью состояний переменных (/trace)
+
+        Возвращает {"result": текст, "steps": шаги трассировки, "output": вывод, "truncated": bool}.
+        """
+        trace = {"result": None, "steps": [], "output": "", "truncated": False}
+        if not code.strip():
+            trace["result"] = "Введите код для выполнения"
+            return trace
+
+        self.execution_count += 1
+        self._refresh_limits()
+        error = self._check_code(code)
+        if error:
+            trace["result"] = error
+            return trace
+
+        stdout = io.StringIO()
+        tracer = ExecutionTracer(stdout, self._baseline_names, max_steps=max_steps)
         try:
-            return self._execute_safely(code)
-            
+            compiled = compile(code, TRACE_FILENAME, 'exec')
+            trace["result"] = self._execute_safely(compiled, stdout=stdout, tracer=tracer)
         except TimeoutException as e:
-            return f"⏰ {str(e)}"
+            trace["result"] = f"⏰ {str(e)}"
         except MemoryLimitException as e:
-            return f"💥 {str(e)}"
+            trace["result"] = f"💥 {str(e)}"
         except Exception as e:
-            return f"❌ Ошибка выполнения: {str(e)}"
+            trace["result"] = f"❌ Ошибка выполнения: {str(e)}"
 
-    def _execute_safely(self, code: str) -> str:
+        trace["steps"] = tracer.steps
+        trace["output"] = self._truncate_output(stdout.getvalue())
+        trace["truncated"] = tracer.truncated
+        return trace
+
+    def _execute_safely(self, code: str, time_limit: int = None, stdout=None, tracer=None) -> str:
         """Безопасное выполнение кода с ограничениями"""
-        stdout = io.StringIO()
+        if stdout is None:
+            stdout = io.StringIO()
         stderr = io.StringIO()
         
         result = None
         
         try:
-            with redirect_stdout(stdout), redirect_stderr(stderr):
+            with redirect_stdout(stdout), redirect_stderr(stderr), (tracer or nullcontext()):
                 # Ограничение по времени выполнения
-                result = self._execute_with_timeout(code)
+                result = self._execute_with_timeout(code, time_limit)
                 
             # Получаем вывод
             output = stdout.getvalue()
@@ -94,30 +282,34 @@ class PythonConsole:
             raise MemoryLimitException("Превышено потребление памяти")
         except Exception as e:
             # Перехватываем все остальные исключения
+            self.last_error_type = type(e).__name__
             return f"❌ Ошибка выполнения: {str(e)}"
 
-    def _execute_with_timeout(self, code: str):
+    def _execute_with_timeout(self, code: str, time_limit: int = None):
         """Выполнение кода с таймаутом"""
+        time_limit = time_limit or self.max_execution_time
         
         def timeout_handler(signum, frame):
-            raise TimeoutException(f"Время выполнения истекло ({self.max_execution_time} секунд)")
+            raise TimeoutException(f"Время выполнения истекло ({time_limit} секунд)")
         
         # Устанавливаем обработчик таймаута (только для Unix-систем)
         try:
             signal.signal(signal.SIGALRM, timeout_handler)
-            signal.alarm(self.max_execution_time)
+            signal.alarm(time_limit)
             
-            try:
-                # Пробуем выполнить как выражение (для одной строки)
-                return eval(code, self.local_vars)
-            except SyntaxError:
-                # Если не выражение, выполняем как statement
+            if not isinstance(code, str):
+                # Уже скомпилированный код (например, для /trace) выполняется один раз
                 exec(code, self.local_vars)
                 return None
-            except:
-                # Если eval упал с другой ошибкой, пробуем exec
-                exec(code, self.local_vars)
+            
+            compiled, is_expression = compile_code(code)
+            if not is_expression:
+                # Если не выражение, выполняем как statement
+                exec(compiled, self.local_vars)
                 return None
+            
+            # Выражение выполняется один раз: его ошибки (и таймаут) – результат запуска
+            return eval(compiled, self.local_vars)
                 
         finally:
             # Всегда отключаем таймер
@@ -139,7 +331,7 @@ class PythonConsole:
         
         # Добавляем результат выражения
         if result is not None:
-            response_parts.append(str(result))
+            response_parts.append(self._truncate_output(str(result)))
         
         # Собираем финальный ответ
         response = '\n'.join(response_parts)
@@ -210,9 +402,10 @@ class PythonConsole:
 
 # Альтернативная реализация для Windows (где нет signal.SIGALRM)
 class WindowsPythonConsole(PythonConsole):
-    def _execute_with_timeout(self, code: str):
+    def _execute_with_timeout(self, code: str, time_limit: int = None):
         """Реализация таймаута для Windows"""
         import threading
+        time_limit = time_limit or self.max_execution_time
         
         class ExecutionThread(threading.Thread):
             def __init__(self, code, local_vars):
@@ -224,13 +417,12 @@ class WindowsPythonConsole(PythonConsole):
                 
             def run(self):
                 try:
-                    try:
-                        self.result = eval(self.code, self.local_vars)
-                    except SyntaxError:
-                        exec(self.code, self.local_vars)
-                        self.result = None
-                    except:
-                        exec(self.code, self.local_vars)
+                    # Выражение выполняется один раз, как и в основной реализации
+                    compiled, is_expression = compile_code(self.code)
+                    if is_expression:
+                        self.result = eval(compiled, self.local_vars)
+                    else:
+                        exec(compiled, self.local_vars)
                         self.result = None
                 except Exception as e:
                     self.exception = e
@@ -238,11 +430,11 @@ class WindowsPythonConsole(PythonConsole):
         # Запускаем выполнение в отдельном потоке
         thread = ExecutionThread(code, self.local_vars)
         thread.start()
-        thread.join(self.max_execution_time)
+        thread.join(time_limit)
         
         if thread.is_alive():
             # Если поток еще жив, значит время истекло
-            raise TimeoutException(f"Время выполнения истекло ({self.max_execution_time} секунд)")
+            raise TimeoutException(f"Время выполнения истекло ({time_limit} секунд)")
         
         if thread.exception:
             raise thread.exception
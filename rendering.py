@@ -0,0 +1,331 @@
+import textwrap
+from functools import lru_cache
+
+from telegram.constants import MessageLimit
+
+from limits import limits
+from tracer import state_at
+
+# Максимальная длина сообщения Telegram
+MAX_MESSAGE_LENGTH = MessageLimit.MAX_TEXT_LENGTH
+
+# Таблицы экранирования строятся один раз при импорте
+_MARKDOWN_V2_TABLE = str.maketrans({char: '\\' + char for char in '\\_*[]()~`>#+-=|{}.!'})
+_CODE_TABLE = str.maketrans({'\\': '\\\\', '`': '\\`'})
+_MARKDOWN_TABLE = str.maketrans({char: '\\' + char for char in '_*`['})
+
+_CODE_OPEN = "```python\n"
+_CODE_CLOSE = "\n```"
+# Метка сокращенного раздела /trace (не требует экранирования)
+_ELIDED = "…"
+
+# Статические тексты команд; готовые строки кэшируются в render_static.
+# Ограничения подставляются из limits, приветствие – с именем пользователя
+_STATIC_TEXTS = {
+    "welcome": """
+🤖 *Привет, {first_name}!*
+
+Добро пожаловать в *Python Learning Bot* – интерактивный бот для обучения Python!
+
+📚 *Возможности:*
+💻 `/console` – Интерактивная Python консоль
+📖 `/lessons` – Уроки по Python
+🛡️ `/security` – Информация о безопасности
+📊 `/stats` – Ваша статистика
+❓ `/help` – Справка
+🎯 `/quiz` – Тест по Python
+
+🚀 *Начните вводить Python код, и я его выполню!*
+
+Пример:
+```
+print("Hello, Python!")
+x = 5 * 10
+x
+```
+        """,
+    "help": """
+📚 *Справка по Python Learning Bot*
+
+*Команды:*
+• `/start` – Главное меню
+• `/console` – Открыть консоль
+• `/lessons` – Уроки (5 уровней)
+• `/quiz` – Тест по Python
+• `/stats` – Ваша статистика
+• `/top` – Рейтинг учеников
+• `/reset` – Сбросить консоль
+• `/security` – О безопасности
+• `/trace` – Пошаговая визуализация кода
+• `/cell`, `/edit N`, `/cells` – Блокнот с перезапуском зависимых ячеек
+• `/run` – Долгое выполнение с потоковым выводом (для доверенных)
+• `/class_stats` – Статистика класса (для учителей)
+
+*Возможности консоли:*
+✅ Выполнение Python кода
+✅ Сохранение переменных между запусками
+✅ Доступные модули: math, json, datetime, random
+✅ Ограничения: {max_code_length} символов, {max_execution_time} секунд на выполнение
+
+*Примеры:*
+```python
+# Переменные
+name = "Python"
+age = 30
+
+# Цикл
+for i in range(5):
+    print(i)
+
+# Функция
+def hello(x):
+    return x * 2
+
+# Математика
+import math
+math.sqrt(16)
+```
+        """,
+    "security": """
+🛡️ *Информация о безопасности бота*
+
+*Ограничения для защиты:*
+• Максимальная длина кода: {max_code_length} символов
+• Время выполнения: {max_execution_time} секунд
+• Память: {max_memory_mb} МБ
+
+*Запрещено:*
+❌ `import os`, `sys`, `subprocess`
+❌ `__import__()`, `eval()`, `exec()`
+❌ `open()`, `read()`, `write()` файлы
+❌ `socket`, `urllib`, `requests`
+❌ Доступ к приватным атрибутам (`__*__`)
+
+*Разрешено:*
+✅ `math` – математика
+✅ `json` – JSON данные
+✅ `datetime` – время
+✅ `random` – случайные числа
+✅ Встроенные функции (print, len, range и т.д.)
+✅ Работа с переменными, функциями, циклами
+✅ Списки, словари, кортежи, множества
+
+*Как работает безопасность:*
+1. Сканирование кода на опасные функции
+2. Проверка синтаксиса
+3. Контроль использования памяти
+4. Таймаут выполнения
+5. Фильтрация вывода ошибок
+
+        """,
+}
+
+
+def escape_markdown_v2(text: str) -> str:
+    """Экранирование обычного текста для MarkdownV2"""
+    return text.translate(_MARKDOWN_V2_TABLE)
+
+
+def escape_code(text: str) -> str:
+    """Экранирование текста внутри блока кода MarkdownV2"""
+    return text.translate(_CODE_TABLE)
+
+
+def escape_markdown(text: str) -> str:
+    """Экранирование пользовательского текста для старого Markdown"""
+    return text.translate(_MARKDOWN_TABLE)
+
+
+def _split_escaped(text: str, escape, limit: int) -> list:
+    """Разбиение текста на части, каждая из которых после экранирования не длиннее limit
+
+    Текст режется по строкам, слишком длинные строки – по символам,
+    поэтому escape-последовательность никогда не разрывается.
+    """
+    chunks = []
+    current = []
+    current_length = 0
+
+    for line in text.splitlines(keepends=True):
+        escaped = escape(line)
+        if len(escaped) > limit:
+            # Строка не помещается целиком – режем посимвольно
+            for char in line:
+                escaped_char = escape(char)
+                if current_length + len(escaped_char) > limit:
+                    chunks.append(''.join(current))
+                    current, current_length = [], 0
+                current.append(escaped_char)
+                current_length += len(escaped_char)
+            continue
+
+        if current_length + len(escaped) > limit:
+            chunks.append(''.join(current))
+            current, current_length = [], 0
+        current.append(escaped)
+        current_length += len(escaped)
+
+    if current or not chunks:
+        chunks.append(''.join(current))
+    return chunks
+
+
+def render_execution(code: str, result: str, max_length: int = None) -> list:
+    """Результат выполнения в виде блоков кода MarkdownV2 (по 4096 символов)
+
+    Результат длиннее `max_length` (по умолчанию limits.max_output_length)
+    обрезается, чтобы один запуск не превращался в десятки сообщений.
+    """
+    limit = MAX_MESSAGE_LENGTH - len(_CODE_OPEN) - len(_CODE_CLOSE)
+    max_length = max_length or limits.max_output_length
+    if len(result) > max_length:
+        result = result[:max_length] + "... (вывод обрезан)"
+    body = f">>> {code}\n{result}"
+    return [f"{_CODE_OPEN}{chunk}{_CODE_CLOSE}" for chunk in _split_escaped(body, escape_code, limit)]
+
+
+def render_cells(cells: list) -> list:
+    """Ячейки блокнота [(номер, код, результат)] блоками кода MarkdownV2"""
+    limit = MAX_MESSAGE_LENGTH - len(_CODE_OPEN) - len(_CODE_CLOSE)
+    blocks = []
+    for number, code, result in cells:
+        label = number if number is not None else '-'
+        code_lines = code.splitlines() or [""]
+        block = f"In [{label}]: {code_lines[0]}"
+        for line in code_lines[1:]:
+            block += f"\n   ...: {line}"
+        blocks.append(f"{block}\nOut[{label}]: {result if result is not None else ''}")
+    body = '\n\n'.join(blocks) or "Блокнот пуст"
+    return [f"{_CODE_OPEN}{chunk}{_CODE_CLOSE}" for chunk in _split_escaped(body, escape_code, limit)]
+
+
+def render_stream(code: str, output: str) -> str:
+    """Промежуточное состояние /run: хвост вывода в одном сообщении"""
+    limit = MAX_MESSAGE_LENGTH - len(_CODE_OPEN) - len(_CODE_CLOSE)
+    chunks = _split_escaped(f">>> {code}\n{output}", escape_code, limit)
+    return f"{_CODE_OPEN}{chunks[-1]}{_CODE_CLOSE}"
+
+
+def render_trace_page(code: str, trace: dict, index: int, context_lines: int = 4) -> str:
+    """Страница /trace: окно кода с текущей строкой, переменные кадра и вывод на этом шаге"""
+    steps = trace["steps"]
+    line_number, scope, variables, output_length = state_at(steps, index)
+
+    lines = code.splitlines()
+    first = max(1, line_number - context_lines)
+    last = min(len(lines), line_number + context_lines)
+    listing = '\n'.join(
+        f"{'➡' if number == line_number else ' '}{number:3} | {lines[number - 1][:80]}"
+        for number in range(first, last + 1)
+    )
+    state = '\n'.join(f"{name} = {value}"[:80] for name, value in variables.items()) or "(нет переменных)"
+
+    header = f"🔍 Шаг {index + 1}/{len(steps)} · строка {line_number} · {scope}"
+    if trace["truncated"]:
+        header += f" (записаны первые {len(steps)} шагов)"
+
+    # Разделы: (подпись, текст, открытие блока кода или None, берется ли хвост)
+    sections = [
+        (None, listing, _CODE_OPEN, False),
+        ("Переменные:", state, "```\n", False),
+    ]
+    output = trace["output"][:output_length]
+    if output:
+        sections.append(("Вывод:", output[-500:], "```\n", True))
+    if index == len(steps) - 1 and trace["result"]:
+        sections.append((None, trace["result"][:500], None, False))
+
+    parts = [escape_markdown_v2(header)]
+    used = len(parts[0])
+    for label, text, fence, tail in sections:
+        # Раздел укорачивается по сырому тексту (целыми строками) до экранирования,
+        # поэтому escape-последовательность и блок кода никогда не обрываются
+        section = [escape_markdown_v2(label)] if label else []
+        overhead = sum(len(part) + 1 for part in section) + 1
+        if fence is not None:
+            overhead += len(fence) + len(_CODE_CLOSE)
+        budget = MAX_MESSAGE_LENGTH - used - overhead - len(_ELIDED)
+        if budget < 40:
+            break
+        escape = escape_code if fence is not None else escape_markdown_v2
+        chunks = _split_escaped(text, escape, budget)
+        body = chunks[-1] if tail else chunks[0]
+        if len(chunks) > 1:
+            body = _ELIDED + body if tail else body + _ELIDED
+        if fence is not None:
+            body = f"{fence}{body}{_CODE_CLOSE}"
+        section.append(body)
+        parts.extend(section)
+        used += sum(len(part) + 1 for part in section)
+
+    return '\n'.join(parts)
+
+
+def render_leaderboard(leaders: list, rank, total: int) -> str:
+    """Рейтинг /top: первые места и место пользователя (обычный текст)"""
+    medals = {1: "🥇", 2: "🥈", 3: "🥉"}
+    lines = ["🏆 Рейтинг учеников (успешные запуски кода)", ""]
+    for place, (_, name, score) in enumerate(leaders, 1):
+        lines.append(f"{medals.get(place, f'{place}.')} {name} – {score}")
+    if not leaders:
+        lines.append("Пока никто не выполнял код")
+    if rank is not None:
+        lines.append("")
+        lines.append(f"Ваше место: {rank} из {total}")
+    return "\n".join(lines)
+
+
+def render_class_stats(summary: dict) -> str:
+    """Сводка /class_stats (обычный текст)"""
+    lines = [
+        "📊 Статистика класса",
+        "",
+        f"Учеников: {summary['users']}",
+        f"Выполнений: {summary['executions']}",
+        f"Ошибок: {summary['errors']} ({summary['error_rate']:.0%})",
+    ]
+    if summary["top_errors"]:
+        lines.append("")
+        lines.append("Частые ошибки:")
+        for error_type, count in summary["top_errors"]:
+            lines.append(f"• {error_type} – {count}")
+    return "\n".join(lines)
+
+
+def render_rejection(title: str, issues: list, hint: str = None) -> str:
+    """Отказ в выполнении (MarkdownV2): жирный заголовок, список причин и подсказка
+
+    Причины содержат произвольный текст (шаблоны проверок, имена функций
+    пользователя), поэтому экранируются целиком.
+    """
+    lines = [f"*{escape_markdown_v2(title)}:*"]
+    lines.extend(escape_markdown_v2(issue) for issue in issues)
+    if hint:
+        lines.append("")
+        lines.append(escape_markdown_v2(hint))
+    return '\n'.join(lines)
+
+
+def render_text(text: str) -> list:
+    """Обычный текст, экранированный для MarkdownV2 и разбитый на сообщения"""
+    return _split_escaped(text, escape_markdown_v2, MAX_MESSAGE_LENGTH)
+
+
+def render_static(name: str) -> str:
+    """Готовый текст статического сообщения (для parse_mode='Markdown')"""
+    limits.refresh()
+    return _render_static(name, limits.version)
+
+
+@lru_cache(maxsize=64)
+def _render_static(name: str, version: int) -> str:
+    # version входит в ключ кэша: после изменения ограничений текст пересобирается
+    text = textwrap.dedent(_STATIC_TEXTS[name])
+    if name == "welcome":
+        return text
+    return text.format(**limits.as_dict())
+
+
+def render_welcome(first_name: str) -> str:
+    """Приветствие с подставленным именем пользователя"""
+    return render_static("welcome").format(first_name=escape_markdown(first_name or ""))
@@ -0,0 +1,265 @@
+import asyncio
+import heapq
+import itertools
+import time
+from contextlib import asynccontextmanager
+from contextvars import ContextVar
+from enum import IntEnum
+
+from telegram import Update
+from telegram.ext import BaseUpdateProcessor
+
+
+class Priority(IntEnum):
+    """Классы обработки обновлений (меньше – важнее)"""
+    UI = 0  # Навигация, уроки, /help, /stats
+    SHORT = 1  # Обычное выполнение кода
+    LONG = 2  # /run и другие тяжелые задачи
+
+
+class _TenantState:
+    """Доля арендатора (бота) в общем пуле песочниц"""
+
+    def __init__(self, weight: float = 1.0, max_running: int = None):
+        self.weight = weight
+        self.max_running = max_running  # Квота одновременных выполнений (None – без квоты)
+        self.running = 0
+        self.pass_value = 0.0  # Метка stride-планирования: меньше – раньше
+        self.virtual_time = 0.0  # Виртуальное время WFQ между его пользователями
+
+
+class PriorityScheduler:
+    """Планировщик выполнения кода с приоритетами и честной очередью
+
+    Сессия пользователя закреплена за одним воркером, поэтому слот выдается
+    на конкретный воркер: у каждого воркера своя очередь, и занятый воркер
+    не задерживает пользователей других воркеров. Заявку подает исполнитель
+    уже после того, как выбрал воркер пользователя.
+
+    UI-запросы допускаются сразу и никогда не ждут выполнения кода.
+    На каждом воркере SHORT обслуживается первым, но LONG, прождавший
+    дольше `aging_seconds`, получает слот вне очереди (защита от голодания);
+    одновременно выполняется не больше `long_capacity` задач LONG.
+
+    Если в процессе несколько ботов (арендаторов), слоты сначала делятся
+    между ними пропорционально весу (stride scheduling), а арендатор,
+    достигший своей квоты одновременных выполнений, ждет, не мешая другим.
+    Внутри арендатора пользователи чередуются по схеме weighted fair queuing:
+    каждая заявка получает виртуальную метку завершения, и первым идет
+    наименьшая метка.
+    """
+
+    def __init__(self, workers: int, long_capacity: int = 1, aging_seconds: float = 10.0):
+        self.workers = max(1, workers)
+        self.long_capacity = max(1, min(long_capacity, self.workers))
+        self.aging_seconds = aging_seconds
+
+        self._running = {Priority.SHORT: 0, Priority.LONG: 0}
+        self._busy = set()  # Воркеры, слот которых сейчас выдан
+        # Воркер -> класс -> {арендатор: куча (метка, seq, время, future, стоимость)}
+        self._queues = [{Priority.SHORT: {}, Priority.LONG: {}} for _ in range(self.workers)]
+        self._tenants = {}  # арендатор -> _TenantState
+        self._global_pass = 0.0
+        self._finish_tags = {}  # (арендатор, user_id) -> последняя метка завершения
+        self._sequence = itertools.count()
+
+    def configure_tenant(self, tenant, weight: float = 1.0, max_running: int = None):
+        """Вес арендатора и его квота одновременных выполнений"""
+        state = self._tenant(tenant)
+        state.weight = max(weight, 0.01)
+        state.max_running = max_running
+
+    def _tenant(self, tenant) -> _TenantState:
+        state = self._tenants.get(tenant)
+        if state is None:
+            state = self._tenants[tenant] = _TenantState()
+        return state
+
+    @property
+    def running(self) -> int:
+        """Число выполняемых сейчас задач"""
+        return self._running[Priority.SHORT] + self._running[Priority.LONG]
+
+    @property
+    def queued(self) -> int:
+        """Число задач в очереди"""
+        return sum(
+            len(queue) for worker_queues in self._queues
+            for queues in worker_queues.values() for queue in queues.values()
+        )
+
+    def tenant_load(self, tenant) -> tuple:
+        """(выполняется, в очереди) для арендатора"""
+        queued = sum(
+            len(queues.get(tenant, ())) for worker_queues in self._queues for queues in worker_queues.values()
+        )
+        return self._tenant(tenant).running, queued
+
+    @asynccontextmanager
+    async def slot(self, priority: Priority, user_id: int, cost: float = 1.0, tenant=None, worker: int = 0):
+        """Ожидание слота на воркере `worker` для заявки пользователя"""
+        if priority == Priority.UI:
+            yield
+            return
+
+        await self._acquire(priority, user_id, cost, tenant, worker)
+        try:
+            yield
+        finally:
+            self._release(priority, tenant, worker)
+
+    def _release(self, priority: Priority, tenant, worker: int):
+        self._running[priority] -= 1
+        self._tenant(tenant).running -= 1
+        self._busy.discard(worker)
+        self._dispatch()
+
+    async def _acquire(self, priority: Priority, user_id: int, cost: float, tenant, worker: int):
+        """Постановка заявки в очередь воркера и ожидание допуска"""
+        state = self._tenant(tenant)
+        if state.running == 0 and not self.tenant_load(tenant)[1]:
+            # Простаивавший арендатор не получает накопленного преимущества
+            state.pass_value = max(state.pass_value, self._global_pass)
+
+        key = (tenant, user_id)
+        tag = max(state.virtual_time, self._finish_tags.get(key, 0.0)) + cost
+        self._finish_tags[key] = tag
+        if len(self._finish_tags) > 10000:
+            self._prune_tags()
+
+        future = asyncio.get_running_loop().create_future()
+        queue = self._queues[worker][priority].setdefault(tenant, [])
+        heapq.heappush(queue, (tag, next(self._sequence), time.monotonic(), future, cost))
+        self._dispatch()
+
+        try:
+            await future
+        except asyncio.CancelledError:
+            # Слот мог быть выдан одновременно с отменой – возвращаем его
+            if future.done() and not future.cancelled():
+                self._release(priority, tenant, worker)
+            raise
+
+    def _prune_tags(self):
+        """Удаление меток, которые уже не влияют на порядок"""
+        self._finish_tags = {
+            key: tag for key, tag in self._finish_tags.items()
+            if tag > self._tenant(key[0]).virtual_time
+        }
+
+    def _head(self, worker: int, priority: Priority):
+        """(арендатор, первая живая заявка) воркера с наименьшей меткой stride среди арендаторов в пределах квоты"""
+        best = None
+        for tenant, queue in self._queues[worker][priority].items():
+            while queue and queue[0][3].done():
+                heapq.heappop(queue)  # Отмененные заявки выбрасываются
+            if not queue:
+                continue
+            state = self._tenants[tenant]
+            if state.max_running is not None and state.running >= state.max_running:
+                continue
+            order = (state.pass_value, queue[0][0], queue[0][1])
+            if best is None or order < best[0]:
+                best = (order, tenant, queue[0])
+        return None if best is None else best[1:]
+
+    def _dispatch(self):
+        """Выдача слотов свободным воркерам"""
+        granted = True
+        while granted:
+            # Выдача меняет метки stride и квоты, поэтому после нее воркеры просматриваются заново
+            granted = False
+            for worker in range(self.workers):
+                if worker not in self._busy and self._grant(worker):
+                    granted = True
+
+    def _grant(self, worker: int) -> bool:
+        """Выдача слота воркера лучшей заявке; False – выдавать некому"""
+        short_head = self._head(worker, Priority.SHORT)
+        long_head = self._head(worker, Priority.LONG)
+        long_allowed = long_head is not None and self._running[Priority.LONG] < self.long_capacity
+
+        if long_allowed and (
+            short_head is None
+            or time.monotonic() - long_head[1][2] >= self.aging_seconds
+        ):
+            priority, (tenant, _) = Priority.LONG, long_head
+        elif short_head is not None:
+            priority, (tenant, _) = Priority.SHORT, short_head
+        else:
+            return False
+
+        tag, _, _, future, cost = heapq.heappop(self._queues[worker][priority][tenant])
+        state = self._tenants[tenant]
+        state.virtual_time = max(state.virtual_time, tag)
+        self._global_pass = max(self._global_pass, state.pass_value)
+        state.pass_value += cost / state.weight
+        state.running += 1
+        self._running[priority] += 1
+        self._busy.add(worker)
+        future.set_result(None)
+        return True
+
+
+# Класс обновления, которое сейчас обрабатывается; по нему исполнитель
+# запрашивает слот воркера (задачи, созданные обработчиком, наследуют значение)
+current_priority = ContextVar("current_priority", default=Priority.SHORT)
+
+
+class ScheduledUpdateProcessor(BaseUpdateProcessor):
+    """Обработчик обновлений PTB, классифицирующий их для PriorityScheduler
+
+    Само обновление не ждет слота: слот воркера запрашивает исполнитель,
+    когда обработчик доходит до выполнения кода, с классом этого обновления.
+    """
+
+    def __init__(self, scheduler: PriorityScheduler, short_commands=(), long_commands=(),
+                 max_concurrent_updates: int = 4096, tenant=None):
+        super().__init__(max_concurrent_updates)
+        self.scheduler = scheduler
+        self.tenant = tenant  # Бот, обновления которого обрабатываются (общий планировщик)
+        self.short_commands = {f"/{command}" for command in short_commands}
+        self.long_commands = {f"/{command}" for command in long_commands}
+        self.in_flight = set()  # Задачи обрабатываемых сейчас обновлений
+
+    def classify(self, update: object):
+        """Определение класса обновления и пользователя"""
+        if not isinstance(update, Update) or update.effective_user is None:
+            return Priority.UI, None
+        message = update.message
+        if message is None or not message.text:
+            return Priority.UI, update.effective_user.id
+
+        text = message.text
+        if text.startswith('/'):
+            command = text.split(None, 1)[0].split('@', 1)[0]
+            if command in self.long_commands:
+                return Priority.LONG, update.effective_user.id
+            if command in self.short_commands:
+                return Priority.SHORT, update.effective_user.id
+            return Priority.UI, update.effective_user.id
+        return Priority.SHORT, update.effective_user.id
+
+    async def do_process_update(self, update: object, coroutine) -> None:
+        priority, user_id = self.classify(update)
+        task = asyncio.current_task()
+        self.in_flight.add(task)
+        token = current_priority.set(priority)
+        try:
+            await coroutine
+        finally:
+            current_priority.reset(token)
+            self.in_flight.discard(task)
+
+    def cancel_in_flight(self) -> int:
+        """Отмена еще не завершенных обновлений (при остановке); число отмененных"""
+        tasks = [task for task in self.in_flight if not task.done()]
+        for task in tasks:
+            task.cancel()
+        return len(tasks)
+
+    async def initialize(self) -> None:
+        pass
+
+    async def shutdown(self) -> None:
+        pass
@@ -1,5 +1,6 @@
 import re
 import ast
+from types import SimpleNamespace
 
 class SecurityManager:
     """Менеджер безопасности для бота"""
@@ -76,7 +77,7 @@ class SecurityManager:
         # Базовые встроенные функции
         safe_builtins = {}
         for func in self.whitelisted_builtins:
-            if hasattr(__builtins__, func) if isinstance(__builtins__, dict) else hasattr(__builtins__, func):
+            if func in __builtins__ if isinstance(__builtins__, dict) else hasattr(__builtins__, func):
                 try:
                     if isinstance(__builtins__, dict):
                         safe_builtins[func] = __builtins__[func]
@@ -96,11 +97,12 @@ class SecurityManager:
                 'degrees', 'radians', 'acos', 'asin', 'atan'
             }
             
-            safe_globals['math'] = {
+            # Пространство имен, чтобы работал привычный вызов math.sqrt(16)
+            safe_globals['math'] = SimpleNamespace(**{
                 func: getattr(math, func) 
                 for func in safe_math 
                 if hasattr(math, func)
-            }
+            })
         except ImportError:
             pass
         
@@ -0,0 +1,358 @@
+import asyncio
+import json
+import logging
+import os
+import signal
+import time
+
+from telegram import Update
+
+import config
+from executor import SandboxExecutor
+from health import HealthServer, LoopLagMonitor, wait_until
+from metrics import metrics
+from scheduler import PriorityScheduler
+
+# Имя бота по умолчанию (один BOT_TOKEN без файла TENANTS_FILE)
+DEFAULT_TENANT = "default"
+
+
+class TenantConfig:
+    """Настройки одного бота (арендатора) в общем процессе"""
+
+    def __init__(self, name: str, token: str, catalog: str = None, weight: float = 1.0,
+                 max_concurrent: int = None, executions_per_minute: int = None,
+                 teacher_ids=None):
+        self.name = name
+        self.token = token
+        self.catalog = catalog  # Путь к JSON с уроками и викториной (None – встроенный каталог)
+        self.weight = weight  # Доля в общем пуле песочниц относительно других ботов
+        self.max_concurrent = max_concurrent  # Одновременных выполнений (None – без квоты)
+        self.executions_per_minute = executions_per_minute  # None – без квоты
+        self.teacher_ids = set(teacher_ids) if teacher_ids is not None else config.TEACHER_IDS
+        # Файлы бота по умолчанию лежат прямо в STATE_DIR, как до появления арендаторов
+        if name == DEFAULT_TENANT:
+            self.state_dir = config.STATE_DIR
+        else:
+            self.state_dir = os.path.join(config.STATE_DIR, "tenants", name)
+
+    def state_path(self, path: str) -> str:
+        """Путь к файлу состояния (из config.py) в каталоге этого бота"""
+        return os.path.join(self.state_dir, os.path.basename(path))
+
+    @classmethod
+    def from_env(cls) -> "TenantConfig":
+        """Единственный бот с токеном из BOT_TOKEN"""
+        return cls(DEFAULT_TENANT, os.getenv('BOT_TOKEN'))
+
+
+def load_tenants(path: str = config.TENANTS_FILE) -> list:
+    """Список ботов из TENANTS_FILE; без файла – один бот с BOT_TOKEN
+
+    Формат: [{"name": "class-a", "token_env": "CLASS_A_TOKEN", "catalog": "catalogs/a.json",
+    "weight": 1, "max_concurrent": 1, "executions_per_minute": 120, "teacher_ids": [1]}].
+    Токен лучше передавать через переменную окружения (token_env), а не в файле (token).
+    Отсутствующая квота – без ограничения; заданная должна быть не меньше 1,
+    иначе ValueError при запуске.
+    """
+    if not path:
+        return [TenantConfig.from_env()]
+
+    with open(path, encoding='utf-8') as f:
+        entries = json.load(f)
+
+    tenants = []
+    for entry in entries:
+        token = entry.get("token") or os.getenv(entry.get("token_env", ""))
+        if not token:
+            raise ValueError(f"Не задан токен бота {entry.get('name')}")
+        # Квота 0 молча отклоняла бы все запуски бота – такая настройка считается ошибкой
+        for key in ("max_concurrent", "executions_per_minute"):
+            value = entry.get(key)
+            if value is not None and (not isinstance(value, int) or isinstance(value, bool) or value < 1):
+                raise ValueError(f"{key} бота {entry.get('name')} должно быть целым числом не меньше 1 (или отсутствовать)")
+        weight = entry.get("weight", 1.0)
+        if not isinstance(weight, (int, float)) or isinstance(weight, bool) or weight <= 0:
+            raise ValueError(f"weight бота {entry.get('name')} должен быть положительным числом")
+        tenants.append(TenantConfig(
+            entry["name"], token,
+            catalog=entry.get("catalog"),
+            weight=entry.get("weight", 1.0),
+            max_concurrent=entry.get("max_concurrent"),
+            executions_per_minute=entry.get("executions_per_minute"),
+            teacher_ids=entry.get("teacher_ids"),
+        ))
+    if len({tenant.name for tenant in tenants}) != len(tenants):
+        raise ValueError("Имена ботов в TENANTS_FILE должны быть уникальными")
+    return tenants
+
+
+class TenantQuota:
+    """Квота выполнений в минуту (token bucket); None – без ограничения"""
+
+    def __init__(self, per_minute: int = None):
+        self.per_minute = per_minute
+        self._tokens = float(per_minute or 0)
+        self._updated = time.monotonic()
+
+    def allow(self) -> bool:
+        if self.per_minute is None:
+            return True
+        now = time.monotonic()
+        self._tokens = min(self.per_minute, self._tokens + (now - self._updated) * self.per_minute / 60)
+        self._updated = now
+        if self._tokens < 1:
+            return False
+        self._tokens -= 1
+        return True
+
+
+class TenantExecutor:
+    """Общий пул песочниц с точки зрения одного бота
+
+    Сессии хранятся под ключом (бот, user_id), поэтому один ученик в двух
+    ботах получает две независимые консоли. Перед выполнением проверяется
+    квота бота.
+    """
+
+    def __init__(self, executor: SandboxExecutor, tenant: TenantConfig):
+        self.executor = executor
+        self.tenant = tenant
+        self.quota = TenantQuota(tenant.executions_per_minute)
+
+    @property
+    def size(self) -> int:
+        return self.executor.size
+
+    @property
+    def max_execution_time(self) -> int:
+        return self.executor.max_execution_time
+
+    def _session(self, user_id: int) -> tuple:
+        return self.tenant.name, user_id
+
+    def _quota_error(self):
+        """Текст отказа, если квота бота исчерпана"""
+        if self.quota.allow():
+            metrics.increment("tenant_executions", label=self.tenant.name)
+            return None
+        metrics.increment("tenant_quota_rejected", label=self.tenant.name)
+        return "❌ Слишком много запусков в этом боте, попробуйте через минуту"
+
+    def has_session(self, user_id: int) -> bool:
+        return self.executor.has_session(self._session(user_id))
+
+    async def execute(self, user_id: int, code: str) -> str:
+        return self._quota_error() or await self.executor.execute(self._session(user_id), code)
+
+    async def run(self, user_id: int, code: str, time_limit: int, output_limit: int, on_output) -> str:
+        error = self._quota_error()
+        if error:
+            return error
+        return await self.executor.run(self._session(user_id), code, time_limit, output_limit, on_output)
+
+    async def trace(self, user_id: int, code: str) -> dict:
+        error = self._quota_error()
+        if error:
+            return {"result": error, "steps": [], "output": "", "truncated": False}
+        return await self.executor.trace(self._session(user_id), code)
+
+    async def notebook(self, user_id: int, action: str, *args) -> list:
+        if action != "listing":
+            error = self._quota_error()
+            if error:
+                return [(None, "", error)]
+        return await self.executor.notebook(self._session(user_id), action, *args)
+
+    def is_running(self, user_id: int) -> bool:
+        return self.executor.is_running(self._session(user_id))
+
+    def cancel(self, user_id: int) -> bool:
+        return self.executor.cancel(self._session(user_id))
+
+    async def reset(self, user_id: int) -> str:
+        return await self.executor.reset(self._session(user_id))
+
+
+class BotHost:
+    """Процесс с одним или несколькими ботами и общим бэкендом выполнения
+
+    Боты делят пул песочниц (а с ним кэш чистых выражений и кэш
+    скомпилированного кода в воркерах), планировщик и метрики. Планировщик
+    делит песочницы между ботами по весу и квотам: слот выдается на
+    конкретный воркер, поэтому шумный бот не занимает воркер вне очереди. Здесь же живут
+    HTTP-сервер (webhook всех ботов, /healthz, /readyz), сигналы остановки
+    и плавное завершение.
+    """
+
+    def __init__(self, webhook_url: str = None, port: int = None):
+        self.webhook_url = os.getenv('WEBHOOK_URL', '') if webhook_url is None else webhook_url
+        self.port = int(os.getenv('PORT', 10000)) if port is None else port
+        # Планировщик выдает слоты по воркерам, поэтому создается под размер пула
+        self.scheduler = PriorityScheduler(
+            workers=config.EXECUTOR_WORKERS,
+            long_capacity=config.SCHEDULER_LONG_CAPACITY,
+            aging_seconds=config.SCHEDULER_AGING_SECONDS
+        )
+        self.executor = SandboxExecutor(
+            workers=self.scheduler.workers, on_result=self._on_result, scheduler=self.scheduler
+        )
+        self.executor.load_sessions(config.SESSIONS_FILE)
+        self.bots = {}  # имя бота -> PythonLearningBot
+
+        self.draining = False  # Идет плавная остановка: новые обновления не принимаются
+        self.lag_monitor = LoopLagMonitor(config.LOOP_LAG_INTERVAL)
+        self.http_server = HealthServer(self.health_report, port=self.port)
+        self._stop_event = None
+        self._drain_task = None
+
+    def add(self, bot):
+        """Регистрация бота; возвращает его представление пула песочниц"""
+        tenant = bot.tenant
+        if tenant.name in self.bots:
+            raise ValueError(f"Бот {tenant.name} уже добавлен")
+        self.bots[tenant.name] = bot
+        self.scheduler.configure_tenant(tenant.name, tenant.weight, tenant.max_concurrent)
+        return TenantExecutor(self.executor, tenant)
+
+    def _on_result(self, session: tuple, error_type: str):
+        """Исход выполнения – в аналитику того бота, чья это сессия"""
+        tenant, user_id = session
+        bot = self.bots.get(tenant)
+        if bot is not None:
+            bot.analytics.record_execution(user_id, error_type)
+
+    def health_report(self) -> tuple:
+        """Состояние для /healthz и /readyz: (готов ли процесс, проверки)"""
+        state_dir_ok = os.path.isdir(config.STATE_DIR) and os.access(config.STATE_DIR, os.W_OK)
+        checks = {
+            "draining": self.draining,
+            "loop_lag_seconds": round(self.lag_monitor.lag, 3),
+            "loop_lag_max_seconds": round(self.lag_monitor.max_lag, 3),
+            "workers": self.executor.size,
+            "workers_alive": self.executor.workers_alive,
+            "workers_busy": self.executor.busy_workers,
+            "scheduler_queued": self.scheduler.queued,
+            "updates_in_flight": sum(len(bot.update_processor.in_flight) for bot in self.bots.values()),
+            "state_dir_writable": state_dir_ok,
+            "bots": len(self.bots),
+        }
+        ready = (
+            not self.draining
+            and self.lag_monitor.lag < config.HEALTH_MAX_LOOP_LAG
+            and self.executor.workers_alive == self.executor.size
+            and self.scheduler.queued < config.HEALTH_MAX_QUEUED
+            and state_dir_ok
+        )
+        return ready, checks
+
+    def _webhook_handler(self, bot):
+        """Прием обновлений Telegram для одного бота"""
+        async def handle(body: bytes) -> int:
+            if self.draining:
+                # Telegram повторит доставку – уже следующему экземпляру
+                return 503
+            try:
+                update = Update.de_json(json.loads(body), bot.application.bot)
+            except ValueError:
+                return 400
+            await bot.application.update_queue.put(update)
+            return 200
+        return handle
+
+    async def start(self):
+        """Запуск пула песочниц, HTTP-сервера и всех ботов"""
+        try:
+            os.makedirs(config.STATE_DIR, exist_ok=True)
+        except OSError as e:
+            logging.error("Не удалось создать каталог состояния: %s", e)
+        self.executor.start()
+        self.lag_monitor.start()
+
+        # Сервер слушает до регистрации webhook в Telegram
+        if self.webhook_url:
+            for bot in self.bots.values():
+                self.http_server.webhooks[f"/{bot.token}"] = self._webhook_handler(bot)
+        try:
+            await self.http_server.start()
+        except OSError as e:
+            logging.error("Не удалось запустить HTTP-сервер: %s", e)
+
+        for bot in self.bots.values():
+            await bot.start_serving(self.webhook_url)
+
+    def is_idle(self) -> bool:
+        """Ни один бот не обрабатывает обновлений"""
+        return all(bot.is_idle() for bot in self.bots.values())
+
+    async def drain(self):
+        """Плавная остановка за DRAIN_TIMEOUT секунд
+
+        Прием обновлений прекращается (webhook отвечает 503, и Telegram
+        доставит обновления следующему экземпляру; опрос останавливается),
+        принятые обновления дорабатываются. Первую половину срока ждем все
+        выполнения, затем останавливаем длительные /run и рассылки, к концу
+        срока снимаем снимки сессий со свободных воркеров и отменяем то, что
+        не успело завершиться.
+        """
+        self.draining = True
+        started = time.monotonic()
+        for bot in self.bots.values():
+            await bot.stop_accepting()
+
+        if not await wait_until(self.is_idle, started + config.DRAIN_TIMEOUT * 0.5):
+            for bot in self.bots.values():
+                await bot.interrupt_long_work()
+            await wait_until(self.is_idle, started + config.DRAIN_TIMEOUT * 0.8)
+
+        await self.executor.checkpoint()
+        cancelled = sum(bot.update_processor.cancel_in_flight() for bot in self.bots.values())
+        if cancelled:
+            logging.warning("Не завершились к сроку и отменены: %s обновлений", cancelled)
+        logging.info("Обработка завершена за %.1f с", time.monotonic() - started)
+
+    async def stop(self):
+        """Остановка ботов и сохранение сессий"""
+        for bot in self.bots.values():
+            await bot.stop_serving()
+        if self._drain_task is None:
+            # После drain() снимки уже сняты, а отмененные команды могли оставить воркеры занятыми
+            await self.executor.checkpoint()
+        self.executor.save_sessions(config.SESSIONS_FILE)
+        self.executor.shutdown()
+        await self.http_server.stop()
+        await self.lag_monitor.stop()
+
+    def on_stop_signal(self):
+        """SIGTERM/SIGINT: плавная остановка; повторный сигнал – немедленная"""
+        if self._drain_task is None:
+            logging.info("Получен сигнал остановки, завершаем обработку")
+            self._drain_task = asyncio.create_task(self.drain())
+            self._drain_task.add_done_callback(lambda task: self._stop_event.set())
+        else:
+            logging.warning("Повторный сигнал остановки, останавливаемся сразу")
+            self._drain_task.cancel()
+            for bot in self.bots.values():
+                bot.update_processor.cancel_in_flight()
+            self._stop_event.set()
+
+    async def serve(self):
+        """Работа до сигнала остановки"""
+        self._stop_event = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            try:
+                loop.add_signal_handler(sig, self.on_stop_signal)
+            except (NotImplementedError, RuntimeError):
+                # Windows: остановка без плавного завершения
+                pass
+
+        await self.start()
+        try:
+            await self._stop_event.wait()
+        finally:
+            await self.stop()
+
+    def run(self):
+        """Запуск процесса"""
+        asyncio.run(self.serve())
@@ -0,0 +1,39 @@
+import unittest
+
+from cost_check import HEAVY, OK, REJECT, CostChecker
+
+
+class CostCheckerTest(unittest.TestCase):
+    """Вердикты статической оценки на граничных входах"""
+
+    def setUp(self):
+        self.checker = CostChecker()
+
+    def assertVerdict(self, code, verdict, reason=None):
+        result = self.checker.check(code)
+        self.assertEqual(result["verdict"], verdict, code)
+        if reason is not None:
+            self.assertIn(reason, result["reasons"])
+
+    def test_huge_power_is_rejected_without_overflow(self):
+        # Показатели не переводятся во float: OverflowError ронял проверку
+        self.assertVerdict("10**10**400", REJECT, "huge_power")
+        self.assertVerdict("x = 2**10**400", REJECT, "huge_power")
+        self.assertVerdict("(2**65535)**(2**65535)", REJECT, "huge_power")
+
+    def test_small_power_is_allowed(self):
+        self.assertVerdict("print(2**100)", OK)
+
+    def test_range_with_infinite_bounds_is_heavy(self):
+        self.assertVerdict("sum(range(-(10**70000), 0))", HEAVY)
+        self.assertVerdict("sum(range(10**70000))", HEAVY)
+
+    def test_small_range_is_allowed(self):
+        self.assertVerdict("sum(range(-10, 10))", OK)
+
+    def test_syntax_error_is_left_to_security_check(self):
+        self.assertVerdict("def (", OK)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,41 @@
+import unittest
+
+from rendering import MAX_MESSAGE_LENGTH, render_trace_page
+
+
+class TraceRenderingTest(unittest.TestCase):
+    """Страницы /trace укладываются в лимит Telegram и не рвут блоки кода"""
+
+    def make_trace(self, code, steps_count, value, output):
+        # Шаг: (строка, область, кадр, изменения, удаленные, длина вывода)
+        lines = len(code.splitlines())
+        steps = [
+            (index % lines + 1, "<module>", 0, {f"v{index % 40}": value}, (), len(output) * (index + 1) // steps_count)
+            for index in range(steps_count)
+        ]
+        return {"result": "❌ Ошибка выполнения: " + value, "steps": steps, "output": output, "truncated": True}
+
+    def assertPagesValid(self, code, trace):
+        for index in range(len(trace["steps"])):
+            page = render_trace_page(code, trace, index)
+            self.assertLessEqual(len(page), MAX_MESSAGE_LENGTH)
+            self.assertEqual(page.count("```") % 2, 0, page)
+            # Экранирующий обратный слеш не остается последним символом блока
+            self.assertNotIn("\\```", page.replace("\\\\", ""))
+
+    def test_long_trace_with_special_characters(self):
+        code = "\n".join(f"s{n} = '\\\\`' * {n}  # ``` {n}" for n in range(60))
+        value = repr("\\`*_[]" * 20)
+        output = ("`\\" * 50 + "\n") * 200
+        self.assertPagesValid(code, self.make_trace(code, 60, value, output))
+
+    def test_short_trace(self):
+        code = "x = 1\nprint(x)"
+        trace = {"result": "1", "steps": [(1, "<module>", 0, {}, (), 0), (2, "<module>", 0, {"x": "1"}, (), 2)],
+                 "output": "1\n", "truncated": False}
+        self.assertPagesValid(code, trace)
+        self.assertIn("x = 1", render_trace_page(code, trace, 1))
+
+
+if __name__ == "__main__":
+    unittest.main()
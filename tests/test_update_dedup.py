@@ -0,0 +1,55 @@
+import json
+import os
+import tempfile
+import time
+import unittest
+
+from update_dedup import UpdateDeduplicator
+
+
+class HighWaterMarkReloadTest(unittest.TestCase):
+    """Отметка update_id после перезапуска: свежая отбрасывает повторы, устаревшая – нет"""
+
+    def setUp(self):
+        directory = tempfile.TemporaryDirectory()
+        self.addCleanup(directory.cleanup)
+        self.state_file = os.path.join(directory.name, "dedup.json")
+
+    def save(self, state):
+        with open(self.state_file, 'w', encoding='utf-8') as f:
+            json.dump(state, f)
+
+    def test_flushed_mark_is_reloaded(self):
+        first = UpdateDeduplicator(state_file=self.state_file, flush_every=1)
+        for update_id in range(1000, 1010):
+            self.assertFalse(first.is_duplicate(update_id))
+        first.flush()
+
+        second = UpdateDeduplicator(state_file=self.state_file)
+        self.assertEqual(second.high_water_mark, 1009)
+        self.assertTrue(second.is_duplicate(1005))
+        self.assertTrue(second.is_duplicate(1009))
+        self.assertFalse(second.is_duplicate(1010))
+
+    def test_stale_mark_is_ignored(self):
+        self.save({"high_water_mark": 1009, "updated_at": time.time() - 2 * 24 * 3600})
+        dedup = UpdateDeduplicator(state_file=self.state_file)
+        self.assertEqual(dedup.high_water_mark, -1)
+        self.assertFalse(dedup.is_duplicate(5))
+
+    def test_mark_without_timestamp_is_ignored(self):
+        self.save({"high_water_mark": 1009})
+        dedup = UpdateDeduplicator(state_file=self.state_file)
+        self.assertFalse(dedup.is_duplicate(1005))
+
+    def test_far_lower_update_id_resets_mark(self):
+        self.save({"high_water_mark": 10_000_000, "updated_at": time.time()})
+        dedup = UpdateDeduplicator(state_file=self.state_file, max_gap=100_000)
+        self.assertTrue(dedup.is_duplicate(9_999_999))
+        self.assertFalse(dedup.is_duplicate(42))
+        self.assertEqual(dedup.high_water_mark, 42)
+        self.assertTrue(dedup.is_duplicate(42))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,165 @@
+import reprlib
+import sys
+
+# Имя "файла" для кода, который нужно трассировать; остальной код не записывается
+TRACE_FILENAME = "<trace>"
+
+_TOOL_NAME = "tgbb-trace"
+
+
+class ExecutionTracer:
+    """Пошаговая запись выполнения кода (как в Python Tutor)
+
+    Использует sys.monitoring (Python 3.12+), иначе sys.settrace.
+    Каждый шаг хранит только изменившиеся переменные своего кадра:
+    (номер строки, область, номер кадра, {имя: repr}, [удаленные имена], длина вывода).
+    Число шагов, переменных и длина repr ограничены.
+    """
+
+    def __init__(self, stdout, hidden_names=(), max_steps: int = 200,
+                 max_variables: int = 20, max_value_length: int = 60):
+        self.stdout = stdout
+        self.hidden_names = frozenset(hidden_names) | {'__builtins__'}
+        self.max_steps = max_steps
+        self.max_variables = max_variables
+        self.steps = []
+        self.truncated = False
+
+        self._repr = reprlib.Repr()
+        self._repr.maxstring = max_value_length
+        self._repr.maxother = max_value_length
+        self._repr.maxlist = self._repr.maxtuple = self._repr.maxset = 8
+        self._repr.maxdict = 6
+        self._frames = {}  # id кадра -> [номер кадра, {имя: repr}]
+        self._frame_count = 0
+        self._tool_id = None
+
+    def _variables(self, frame) -> dict:
+        """Видимые пользователю переменные кадра в виде repr"""
+        is_module = frame.f_code.co_name == "<module>"
+        namespace = frame.f_globals if is_module else frame.f_locals
+        state = {}
+        for name, value in namespace.items():
+            if name in self.hidden_names or name.startswith('_'):
+                continue
+            try:
+                if callable(value) and hasattr(value, '__name__'):
+                    # Без адресов в памяти, чтобы значение не "менялось" между шагами
+                    state[name] = f"<{type(value).__name__} {value.__name__}>"
+                else:
+                    state[name] = self._repr.repr(value)
+            except Exception:
+                state[name] = "<?>"
+            if len(state) >= self.max_variables:
+                break
+        return state
+
+    def _record(self, frame, line_number: int):
+        """Запись шага: только изменения относительно прошлого шага этой области"""
+        if len(self.steps) >= self.max_steps:
+            self.truncated = True
+            return
+
+        entry = self._frames.get(id(frame))
+        if entry is None:
+            entry = self._start_frame(frame)
+        frame_number, previous = entry
+
+        state = self._variables(frame)
+        changes = {name: value for name, value in state.items() if previous.get(name) != value}
+        removed = [name for name in previous if name not in state]
+        entry[1] = state
+
+        self.steps.append((line_number, frame.f_code.co_name, frame_number, changes, removed, self.stdout.tell()))
+
+    def _start_frame(self, frame) -> list:
+        """Новый кадр (id кадров переиспользуются, поэтому состояние сбрасывается)"""
+        self._frame_count += 1
+        entry = self._frames[id(frame)] = [self._frame_count, {}]
+        return entry
+
+    # --- sys.monitoring (Python 3.12+) ---
+
+    def _on_start(self, code, instruction_offset):
+        if code.co_filename != TRACE_FILENAME:
+            return sys.monitoring.DISABLE
+        self._start_frame(sys._getframe(1))
+
+    def _on_line(self, code, line_number):
+        if code.co_filename != TRACE_FILENAME:
+            return sys.monitoring.DISABLE
+        if not self.truncated:
+            self._record(sys._getframe(1), line_number)
+
+    def _on_return(self, code, instruction_offset, retval):
+        if code.co_filename != TRACE_FILENAME:
+            return sys.monitoring.DISABLE
+        if not self.truncated:
+            frame = sys._getframe(1)
+            self._record(frame, frame.f_lineno)
+
+    # --- sys.settrace ---
+
+    def _global_trace(self, frame, event, arg):
+        if frame.f_code.co_filename != TRACE_FILENAME:
+            return None
+        self._start_frame(frame)
+        return self._local_trace
+
+    def _local_trace(self, frame, event, arg):
+        if self.truncated:
+            return None
+        if event in ('line', 'return'):
+            self._record(frame, frame.f_lineno)
+        return self._local_trace
+
+    def __enter__(self):
+        monitoring = getattr(sys, 'monitoring', None)
+        if monitoring is not None:
+            for tool_id in (monitoring.DEBUGGER_ID, monitoring.PROFILER_ID):
+                try:
+                    monitoring.use_tool_id(tool_id, _TOOL_NAME)
+                except ValueError:
+                    continue
+                self._tool_id = tool_id
+                monitoring.register_callback(tool_id, monitoring.events.PY_START, self._on_start)
+                monitoring.register_callback(tool_id, monitoring.events.LINE, self._on_line)
+                monitoring.register_callback(tool_id, monitoring.events.PY_RETURN, self._on_return)
+                monitoring.set_events(
+                    tool_id,
+                    monitoring.events.PY_START | monitoring.events.LINE | monitoring.events.PY_RETURN
+                )
+                return self
+        sys.settrace(self._global_trace)
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if self._tool_id is not None:
+            monitoring = sys.monitoring
+            monitoring.set_events(self._tool_id, 0)
+            monitoring.register_callback(self._tool_id, monitoring.events.PY_START, None)
+            monitoring.register_callback(self._tool_id, monitoring.events.LINE, None)
+            monitoring.register_callback(self._tool_id, monitoring.events.PY_RETURN, None)
+            monitoring.free_tool_id(self._tool_id)
+            self._tool_id = None
+        else:
+            sys.settrace(None)
+        self._frames = {}
+        return False
+
+
+def state_at(steps: list, index: int) -> tuple:
+    """Состояние на шаге index: (строка, область, переменные кадра, длина вывода)
+
+    Восстанавливается из записанных изменений без повторного выполнения.
+    """
+    line_number, scope, frame_number, _, _, output_length = steps[index]
+    variables = {}
+    # Переменные кадра – изменения всех его шагов до index включительно
+    for _, _, step_frame, changes, removed, _ in steps[:index + 1]:
+        if step_frame != frame_number:
+            continue
+        for name in removed:
+            variables.pop(name, None)
+        variables.update(changes)
+    return line_number, scope, variables, output_length
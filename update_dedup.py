@@ -0,0 +1,119 @@
+import json
+import logging
+import os
+import time
+
+
+class UpdateDeduplicator:
+    """Идемпотентная обработка обновлений Telegram по update_id
+
+    Telegram повторно доставляет обновление, если webhook отвечает медленно.
+    Последние `capacity` идентификаторов хранятся в кольцевом буфере, поэтому
+    проверка и запись выполняются за O(1). Всё, что не выше сохраненной
+    отметки (high-water mark), считается уже обработанным.
+
+    После недели без обновлений Telegram выбирает следующий update_id
+    случайно, и он может оказаться ниже отметки. Поэтому отметка старше
+    `max_age` секунд не загружается, а update_id, отстоящий ниже границы
+    больше чем на `max_gap`, сбрасывает ее вместе с буфером.
+    """
+
+    def __init__(self, capacity: int = 4096, state_file: str = None, flush_every: int = 100,
+                 max_age: float = 24 * 3600, max_gap: int = 100_000):
+        self.capacity = capacity
+        self.state_file = state_file
+        self.flush_every = flush_every
+        self.max_age = max_age
+        self.max_gap = max_gap
+        self._last_update = None  # time.time() последнего принятого обновления
+
+        self._ring = [None] * capacity  # Кольцевой буфер update_id
+        self._position = 0
+        self._seen = set()
+        self._unflushed = 0
+
+        # Всё, что не выше floor, отбрасывается без поиска в буфере
+        self.high_water_mark = self._load_high_water_mark()
+        self._floor = self.high_water_mark
+        self.duplicates_dropped = 0
+
+    def _load_high_water_mark(self) -> int:
+        """Загрузка сохраненной отметки после перезапуска"""
+        if not self.state_file:
+            return -1
+        try:
+            with open(self.state_file, encoding='utf-8') as f:
+                state = json.load(f)
+            high_water_mark = int(state["high_water_mark"])
+            updated_at = float(state.get("updated_at", 0))
+        except FileNotFoundError:
+            return -1
+        except (ValueError, KeyError, TypeError, OSError) as e:
+            logging.warning("Не удалось прочитать отметку update_id: %s", e)
+            return -1
+        if time.time() - updated_at > self.max_age:
+            # Отметка без времени или устаревшая: следующий update_id мог быть выбран заново
+            logging.info("Отметка update_id устарела и не используется")
+            return -1
+        self._last_update = updated_at
+        return high_water_mark
+
+    def _reset(self):
+        """Сброс границы и буфера после смены последовательности update_id"""
+        self._ring = [None] * self.capacity
+        self._position = 0
+        self._seen = set()
+        self.high_water_mark = -1
+        self._floor = -1
+
+    def is_duplicate(self, update_id: int) -> bool:
+        """Проверка и регистрация update_id. True – обновление уже приходило"""
+        now = time.time()
+        if self._floor >= 0 and (
+            self._floor - update_id > self.max_gap
+            or (self._last_update is not None and now - self._last_update > self.max_age)
+        ):
+            logging.info("Последовательность update_id начата заново (%s после %s)", update_id, self.high_water_mark)
+            self._reset()
+
+        if update_id <= self._floor or update_id in self._seen:
+            self.duplicates_dropped += 1
+            return True
+
+        # Вытесняем самый старый идентификатор из буфера
+        evicted = self._ring[self._position]
+        if evicted is not None:
+            self._seen.discard(evicted)
+            # update_id растут монотонно, поэтому вытесненные значения
+            # поднимают нижнюю границу
+            if evicted > self._floor:
+                self._floor = evicted
+
+        self._ring[self._position] = update_id
+        self._position = (self._position + 1) % self.capacity
+        self._seen.add(update_id)
+        self._last_update = now
+
+        if update_id > self.high_water_mark:
+            self.high_water_mark = update_id
+
+        self._unflushed += 1
+        if self._unflushed >= self.flush_every:
+            self.flush()
+        return False
+
+    def flush(self):
+        """Сохранение отметки на диск (атомарная замена файла)"""
+        self._unflushed = 0
+        if not self.state_file or self.high_water_mark < 0:
+            return
+        try:
+            directory = os.path.dirname(self.state_file)
+            if directory:
+                os.makedirs(directory, exist_ok=True)
+            tmp_path = f"{self.state_file}.tmp"
+            with open(tmp_path, 'w', encoding='utf-8') as f:
+                json.dump({"high_water_mark": self.high_water_mark, "updated_at": self._last_update or time.time()}, f)
+            os.replace(tmp_path, self.state_file)
+        except OSError as e:
+            logging.warning("Не удалось сохранить отметку update_id: %s", e)